@@ -26,31 +26,81 @@ report gets a mysql connection, and the model of how things should
 be, and simply outputs a dict with its report.
 """
 import argparse
+import cProfile
 import logging
-import os
+import sys
 
 import yaml
 from runner import ReportRunner
-from reports.databases import databases_report
-from labsdb.auditor.reports.tables import extra_tables_report
-from labsdb.auditor.utils import diff_iters
-from labsdb.auditor.models import Model, Table
-from reports.viewdiffs import views_schema_diff_report
+from labsdb.auditor.reports import register_reports
+from labsdb.auditor.checkpoint import Checkpoint, run_fingerprint
+from labsdb.auditor.metrics import REGISTRY
+from labsdb.auditor.modelcache import load_model
+from labsdb.auditor.output import WRITERS, open_writer
+from labsdb.auditor.snapshot import Snapshot
+from labsdb.auditor.utils import SafeLoader
+
+
+def shard_spec(spec):
+    """
+    Parse a shard specification of the form INDEX/COUNT, eg. 3/8
+    """
+    try:
+        index, count = [int(part) for part in spec.split('/')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('%s is not of the form INDEX/COUNT' % spec)
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError('Shard index of %s must be from 1 to %s' % (spec, count))
+    return index, count
 
 
 argparser = argparse.ArgumentParser()
 
 argparser.add_argument('--config-file-path', help='Path to config file', default='config.yaml')
-argparser.add_argument('--output-file-path', help='Path to report output file', default='report.yaml')
+argparser.add_argument('--output-file-path', default='report.yaml',
+                       help='Path to report output file. Set a different one for each shard with --shard')
+argparser.add_argument('--output-format', choices=sorted(WRITERS), default='yaml',
+                       help='Format of report output file: a single YAML list (yaml), one YAML document '
+                            '(yaml-stream) or one JSON line (jsonl) per report, or every distinct finding '
+                            'once with the hosts and dbs it was found on (compact)')
+argparser.add_argument('--flush', action='store_true',
+                       help='Flush report output file to disk after every report, so partial results survive crashes')
 argparser.add_argument('--log-file-path', help='Path to log file', default='audit.log')
 argparser.add_argument('--debug', action='store_true', help='Turn on debug logging')
+argparser.add_argument('--metrics-file-path',
+                       help='Path to write metrics about the run to, in Prometheus textfile collector format. '
+                            'Defaults to audit.prom, or audit-INDEXofCOUNT.prom with --shard')
+argparser.add_argument('--profile', metavar='PROFILE_FILE_PATH',
+                       help='Profile the run with cProfile, and dump the stats to this path. Runs everything in '
+                            'a single thread, since only that is profiled')
+argparser.add_argument('--model-cache-path', default='model-cache.pickle',
+                       help='Path to compiled model cache, empty to always build the model from scratch')
 argparser.add_argument('--ignore-public-dbs', action='store_true',
                        help='Ignore public dbs (useful for running against sanitarium)')
+argparser.add_argument('--state-file-path',
+                       help='Path to snapshot of the last run, for incremental audits. Defaults to '
+                            'audit-state.json, or audit-state-INDEXofCOUNT.json with --shard')
+argparser.add_argument('--full', action='store_true',
+                       help='Audit everything from scratch, instead of only what changed since the last run')
+argparser.add_argument('--checkpoint-file-path',
+                       help='Path to checkpoint completed parts of the run to, for --resume. Defaults to '
+                            'audit-checkpoint.jsonl, or audit-checkpoint-INDEXofCOUNT.jsonl with --shard')
+argparser.add_argument('--resume', action='store_true',
+                       help='Resume an interrupted run, skipping everything it completed')
+argparser.add_argument('--shard', type=shard_spec, metavar='INDEX/COUNT',
+                       help='Audit only the dbs in shard INDEX (from 1) of COUNT. Give every shard its own '
+                            '--output-file-path, their outputs can be combined with python -m labsdb.auditor.merge')
 
 args = argparser.parse_args()
 
 with open(args.config_file_path) as cf:
-    config = yaml.load(cf)
+    config = yaml.load(cf, Loader=SafeLoader)
+
+if args.profile:
+    # cProfile only sees the thread it is enabled in, so do everything in that one
+    serial = {'host-parallelism': 1, 'db-parallelism': 1, 'view-parse-workers': 0}
+    config.update(serial)
+    config['hosts'] = [dict(entry, **serial) if isinstance(entry, dict) else entry for entry in config['hosts']]
 
 
 logging.basicConfig(filename=args.log_file_path,
@@ -58,38 +108,48 @@ logging.basicConfig(filename=args.log_file_path,
                     format='%(asctime)s: %(message)s'
                     )
 
-# Load up the model
-tables = {}
-for ts_path in config['tableschema-files']:
-    with open(ts_path) as ts:
-        tableschema = yaml.load(ts)
-    for tablename, tabledict in tableschema.items():
-        tables[tablename] = Table.from_dict(tablename, tabledict)
-
-mwconf_path = config['mediawiki-config-path']
-all_dblist_path = os.path.join(mwconf_path, 'all.dblist')
-private_dblist_path = os.path.join(mwconf_path, 'private.dblist')
+model = load_model(config, args.ignore_public_dbs, args.model_cache_path or None)
+state_file_path = args.state_file_path or 'audit-state.json'
+checkpoint_file_path = args.checkpoint_file_path or 'audit-checkpoint.jsonl'
+metrics_file_path = args.metrics_file_path or 'audit.prom'
+if args.shard:
+    model = model.sharded(*args.shard)
+    state_file_path = args.state_file_path or 'audit-state-%sof%s.json' % args.shard
+    checkpoint_file_path = args.checkpoint_file_path or 'audit-checkpoint-%sof%s.jsonl' % args.shard
+    metrics_file_path = args.metrics_file_path or 'audit-%sof%s.prom' % args.shard
+    logging.info('Auditing shard %s of %s, with %s private dbs', args.shard[0], args.shard[1], len(model.private_dbs))
 
-with open(all_dblist_path) as all_file, open(private_dblist_path) as priv_file:
-    all_wiki_dbs = [l.strip() for l in all_file.readlines()]
-    priv_wiki_dbs = [l.strip() for l in priv_file.readlines()]
-    dbs, _ = diff_iters(all_wiki_dbs, priv_wiki_dbs)
+# A full run starts from an empty snapshot, but still saves it for the next incremental run
+snapshot = Snapshot(state_file_path) if args.full else Snapshot.load(state_file_path)
 
-private_dbs = dbs
-public_dbs = [db + '_p' for db in private_dbs] if not args.ignore_public_dbs else []
+checkpoint = Checkpoint(checkpoint_file_path, args.resume, run_fingerprint(config, model))
 
-model = Model(private_dbs, public_dbs, tables)
+rr = ReportRunner(config, model, snapshot, checkpoint=checkpoint)
 
-rr = ReportRunner(config, model)
-
-rr.register_report(databases_report)
-rr.register_report(extra_tables_report)
-rr.register_report(views_schema_diff_report)
+register_reports(rr, config)
 
 logging.info('Starting report generation')
-reports = rr.run()
-
-with open(args.output_file_path, 'w') as f:
-    yaml.dump(reports, f)
+writer = open_writer(args.output_file_path, args.output_format, args.flush)
+profile = cProfile.Profile() if args.profile else None
+try:
+    if profile:
+        profile.enable()
+    rr.run(writer)
+finally:
+    if profile:
+        profile.disable()
+        profile.dump_stats(args.profile)
+    writer.close()
+    REGISTRY.write_textfile(metrics_file_path)
+
+snapshot.save()
+if rr.errors:
+    checkpoint.close()
+    logging.error('Reports for %s hosts failed, rerun with --resume to retry just what failed', len(rr.errors))
+else:
+    checkpoint.remove()
 
 logging.info('Finished report generation, output written to %s', args.output_file_path)
+if rr.errors:
+    # Failed hosts are in the output, but cron and alerting need to know too
+    sys.exit(1)
@@ -0,0 +1,130 @@
+# Copyright 2015 Yuvi Panda <yuvipanda@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Script to benchmark every report against a synthetic, in process labsdb host
+
+For each wiki count, generates a FakeCluster from the real tableschema
+files and runs the catalog load and every report against it, printing
+wall time, number of queries and peak memory for each.
+
+    python -m labsdb.auditor.bench --wikis 100,1000,5000 --latency 0.0005
+"""
+import argparse
+import logging
+import resource
+import time
+
+import yaml
+
+from labsdb.auditor.fakedb import FakeCluster
+from labsdb.auditor.host import Host
+from labsdb.auditor.modelcache import load_tables
+from labsdb.auditor.models import Model
+from labsdb.auditor.reports import viewdiffs
+from labsdb.auditor.reports.databases import databases_report
+from labsdb.auditor.reports.tables import extra_tables_report
+from labsdb.auditor.utils import SafeLoader
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+REPORTS = [databases_report, extra_tables_report, viewdiffs.views_schema_diff_report]
+
+
+def _measure(cluster, func):
+    """
+    Run func, returning (result, wall time, query count, peak memory in KiB)
+
+    Peak memory is the traced peak if tracemalloc is available (python 3), and
+    otherwise the growth of the peak RSS of the process, which is only an
+    upper bound of what func used.
+    """
+    cluster.query_counts.clear()
+    if tracemalloc is not None:
+        tracemalloc.start()
+    else:
+        start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start_time = time.time()
+    result = func()
+    elapsed_time = time.time() - start_time
+    if tracemalloc is not None:
+        peak_kib = tracemalloc.get_traced_memory()[1] // 1024
+        tracemalloc.stop()
+    else:
+        peak_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - start_rss
+    return result, elapsed_time, sum(cluster.query_counts.values()), peak_kib
+
+
+def run_benchmark(tables, wikis, config, tables_per_wiki=None, drift=0.0, latency=0.0):
+    """
+    Benchmark the catalog load and every report against a FakeCluster with given number of wikis
+
+    :return: list of dicts with name, seconds, queries and peak_kib for each
+    """
+    private_dbs = ['wiki%05d' % i for i in range(wikis)]
+    model = Model(private_dbs, [db + '_p' for db in private_dbs], tables)
+    cluster = FakeCluster(model, tables_per_wiki, drift, latency)
+    host = Host(dict(config, host='fake'), cluster.connect)
+
+    results = []
+    _, seconds, queries, peak_kib = _measure(cluster, lambda: host.load_catalog(model.private_dbs + model.public_dbs))
+    results.append({'name': 'catalog', 'seconds': seconds, 'queries': queries, 'peak_kib': peak_kib})
+    for report in REPORTS:
+        # Every run starts with cold caches, like a fresh audit.py does
+        viewdiffs.clear_caches()
+        _, seconds, queries, peak_kib = _measure(cluster, lambda: report(host.config, model, host))
+        results.append({'name': report.__name__, 'seconds': seconds, 'queries': queries, 'peak_kib': peak_kib})
+    host.close()
+    return results
+
+
+def main():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('--tableschema-files', nargs='+', default=['whitelisted.yaml', 'greylisted.yaml'],
+                           help='Paths to tableschema files to build the model from')
+    argparser.add_argument('--wikis', default='100,1000,5000', help='Comma separated wiki counts to benchmark')
+    argparser.add_argument('--tables-per-wiki', type=int, help='Number of model tables in each wiki, default all')
+    argparser.add_argument('--drift', type=float, default=0.01, help='Fraction of views / wikis that drift')
+    argparser.add_argument('--latency', type=float, default=0.0, help='Seconds every query takes')
+    argparser.add_argument('--config-file-path', help='Config file to take report settings from')
+    argparser.add_argument('--output-file-path', help='Also write results as YAML to this file')
+    argparser.add_argument('--debug', action='store_true', help='Show report logging')
+    args = argparser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.CRITICAL)
+    config = {'user-dbname-regex': r'(p|u|s)\d{4,5}.*'}
+    if args.config_file_path:
+        with open(args.config_file_path) as cf:
+            config = yaml.load(cf, Loader=SafeLoader)
+
+    tables = load_tables(args.tableschema_files)
+
+    all_results = {}
+    print('%6s  %-26s %10s %10s %12s' % ('wikis', 'name', 'seconds', 'queries', 'peak KiB'))
+    for wikis in [int(w) for w in args.wikis.split(',')]:
+        results = run_benchmark(tables, wikis, config, args.tables_per_wiki, args.drift, args.latency)
+        for result in results:
+            print('%6s  %-26s %10.3f %10s %12s' % (wikis, result['name'], result['seconds'], result['queries'],
+                                                   result['peak_kib']))
+        all_results[wikis] = results
+
+    if args.output_file_path:
+        with open(args.output_file_path, 'w') as f:
+            yaml.dump(all_results, f, default_flow_style=False)
+
+
+if __name__ == '__main__':
+    main()
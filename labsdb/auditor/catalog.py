@@ -0,0 +1,90 @@
+# Copyright 2015 Yuvi Panda <yuvipanda@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Snapshot of what databases and tables exist on a host
+"""
+import MySQLdb.cursors
+
+
+class Catalog(object):
+    """
+    The databases, tables and views on a host, as seen at one point in time
+
+    Built once per host by the ReportRunner and shared by all reports, so
+    that they do not each have to rediscover the server's state.
+    """
+    def __init__(self, databases, tables, views):
+        """
+        :param databases: frozenset of database names
+        :param tables: dict of database name -> frozenset of all table names (including views) in it
+        :param views: dict of database name -> frozenset of names of views in it
+        """
+        self.databases = databases
+        self.tables = tables
+        self.views = views
+
+    def get_tables(self, db):
+        """
+        Get set of tables (including views) in given database, empty if it does not exist
+        """
+        return self.tables.get(db, frozenset())
+
+    def get_views(self, db):
+        """
+        Get set of views in given database, empty if it does not exist
+        """
+        return self.views.get(db, frozenset())
+
+    @classmethod
+    def load(cls, conn, dbs=None, batch_size=100):
+        """
+        Load the catalog of the host conn is connected to
+
+        Uses one query against information_schema.SCHEMATA (so that empty
+        databases are known too) and streamed queries against
+        information_schema.TABLES for everything else.
+
+        :param dbs: Databases to load the tables of, None for all of them. Listing
+                    the tables of a database makes the server open all of their
+                    definitions, so only ask for those of the dbs reports look at
+        :param batch_size: Number of dbs to load the tables of per query
+        """
+        cur = conn.cursor(MySQLdb.cursors.SSCursor)
+        cur.execute('SELECT SCHEMA_NAME FROM information_schema.SCHEMATA')
+        databases = frozenset(r[0] for r in cur)
+
+        query = 'SELECT TABLE_SCHEMA, TABLE_NAME, TABLE_TYPE FROM information_schema.TABLES'
+        if dbs is None:
+            batches = [None]
+        else:
+            dbs = sorted(db for db in set(dbs) if db in databases)
+            batches = [dbs[i:i + batch_size] for i in range(0, len(dbs), batch_size)]
+        tables = {}
+        views = {}
+        for batch in batches:
+            if batch is None:
+                cur.execute(query)
+            else:
+                cur.execute(query + ' WHERE TABLE_SCHEMA IN (%s)' % ', '.join(['%s'] * len(batch)), batch)
+            for db, name, table_type in cur:
+                tables.setdefault(db, set()).add(name)
+                if table_type == 'VIEW':
+                    views.setdefault(db, set()).add(name)
+        cur.close()
+
+        return cls(
+            databases,
+            dict((db, frozenset(names)) for db, names in tables.items()),
+            dict((db, frozenset(names)) for db, names in views.items())
+        )
@@ -0,0 +1,100 @@
+# Copyright 2015 Yuvi Panda <yuvipanda@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Script to verify that the fast view definer parser agrees with the pyparsing one
+
+Builds a corpus of view definitions from the tableschema files (and a few
+variations of each, so that every kind of column definition shows up in
+every table), parses every one of them with both parsers and reports any
+Table where they disagree. Exits with a non zero status if there are any.
+
+    python -m labsdb.auditor.checkparser whitelisted.yaml greylisted.yaml
+"""
+import argparse
+import sys
+import time
+from collections import OrderedDict
+
+from labsdb.auditor.modelcache import load_tables
+from labsdb.auditor.models import Column, Table
+from labsdb.auditor.viewsql import parse_view_sql, parse_view_sql_pyparsing, render_view_sql
+
+
+def _table_key(table):
+    """
+    Everything about a Table that a parser is responsible for, as a comparable tuple
+    """
+    columns = sorted((c.name, c.whitelisted, c.null_if) for c in table.columns.values())
+    return table.name, table.table_name, table.include_row_if, columns
+
+
+def _variants(table):
+    """
+    Yield the table itself, and variations of it with other kinds of columns and row conditions
+    """
+    yield table
+    yield Table(table.name, OrderedDict((n, Column(n)) for n in table.columns), table.include_row_if, table.table_name)
+    yield Table(table.name, OrderedDict((n, Column(n, False)) for n in table.columns), None, table.table_name)
+    yield Table(table.name, OrderedDict((n, Column(n, False, '(%s_deleted & 1)' % n)) for n in table.columns),
+                '(%s <> 0)' % sorted(table.columns)[0], table.table_name)
+
+
+def build_corpus(tables):
+    """
+    Yield (viewname, sql) pairs for all tables, and variations of them
+    """
+    for name in sorted(tables):
+        for table in _variants(tables[name]):
+            sql = render_view_sql(table)
+            yield name, sql
+            # Whitespace after commas is allowed by the grammar too
+            yield name, sql.replace(',', ', ')
+
+
+def check(corpus):
+    """
+    Parse every (viewname, sql) in corpus with both parsers
+
+    :return: list of (viewname, sql) that the parsers disagree on
+    """
+    mismatches = []
+    fast_time = pyparsing_time = 0
+    for viewname, sql in corpus:
+        start_time = time.time()
+        fast = _table_key(parse_view_sql(sql, viewname))
+        fast_time += time.time() - start_time
+        start_time = time.time()
+        reference = _table_key(parse_view_sql_pyparsing(sql, viewname))
+        pyparsing_time += time.time() - start_time
+        if fast != reference:
+            mismatches.append((viewname, sql))
+    print('fast parser: %.3fs, pyparsing parser: %.3fs' % (fast_time, pyparsing_time))
+    return mismatches
+
+
+def main():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('tableschema_files', nargs='+', help='Paths to tableschema files to build corpus from')
+    args = argparser.parse_args()
+
+    corpus = list(build_corpus(load_tables(args.tableschema_files)))
+    mismatches = check(corpus)
+    for viewname, sql in mismatches:
+        print('Mismatch for %s: %s' % (viewname, sql))
+    print('%s definitions checked, %s mismatches' % (len(corpus), len(mismatches)))
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+# Copyright 2015 Yuvi Panda <yuvipanda@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Checkpoints of a run in progress, so that an interrupted run can be resumed
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from labsdb.auditor.utils import json_loads
+
+
+def run_fingerprint(config, model):
+    """
+    Get a dict identifying what a run audits: its model, dbs, shard and config
+
+    A checkpoint is only resumed from by a run with the same fingerprint, since
+    the units completed by a run auditing anything else would be stale.
+    """
+    dbs = '\n'.join(model.private_dbs + model.public_dbs)
+    return {
+        'model': model.digest,
+        'dbs': hashlib.sha1(dbs.encode('utf-8')).hexdigest(),
+        'shard': list(model.shard) if model.shard else None,
+        'config': hashlib.sha1(json.dumps(config, sort_keys=True, default=str).encode('utf-8')).hexdigest(),
+    }
+
+
+class Checkpoint(object):
+    """
+    Results of the units of work of a run that have completed, in a local JSON lines file
+
+    A unit is identified by (host, report, key), where key is None for a whole
+    report, or something smaller (like a db) that the report checkpoints on its
+    own. Every unit is appended to the file as soon as it completes.
+
+    The first line of the file is a header with the fingerprint of the run.
+    """
+    def __init__(self, path, resume=False, fingerprint=None):
+        """
+        :param resume: Load the units completed by the previous run from path, instead of starting over
+        :param fingerprint: run_fingerprint() of the run. When resuming, the checkpoint is
+                            discarded unless the previous run had the same fingerprint
+        """
+        self.path = path
+        self.units = {}
+        cut_short = False
+        if resume and os.path.exists(path):
+            with open(path) as f:
+                data = f.read()
+            lines = data.splitlines()
+            header = None
+            try:
+                header = json_loads(lines[0]) if lines else None
+            except ValueError:
+                pass
+            if header is None or header.get('fingerprint') != fingerprint:
+                logging.warning('Discarding checkpoint %s, it is of a run with a different model, dbs, shard '
+                                'or config', path)
+                resume = False
+            else:
+                for line in lines[1:]:
+                    try:
+                        record = json_loads(line)
+                    except ValueError:
+                        # Last line is cut short if the previous run died while writing it
+                        logging.warning('Ignoring incomplete checkpoint record in %s', path)
+                        continue
+                    self.units[(record['host'], record['report'], record['key'])] = record['result']
+                cut_short = not data.endswith('\n')
+                logging.info('Resuming from %s completed units in %s', len(self.units), path)
+        else:
+            resume = False
+        self._f = open(path, 'a' if resume else 'w')
+        if cut_short:
+            self._f.write('\n')
+        if not resume:
+            self._f.write(json.dumps({'fingerprint': fingerprint}, sort_keys=True) + '\n')
+            self._f.flush()
+        self._lock = threading.Lock()
+
+    def get(self, host, report, key=None):
+        """
+        Get result of a completed unit, None if it has not completed
+        """
+        return self.units.get((host, report, key))
+
+    def record(self, host, report, key, result):
+        """
+        Record result of a completed unit. result must be JSON serializable, and not None
+        """
+        with self._lock:
+            self.units[(host, report, key)] = result
+            self._f.write(json.dumps({'host': host, 'report': report, 'key': key, 'result': result},
+                                     sort_keys=True) + '\n')
+            self._f.flush()
+
+    def scope(self, host, report):
+        """
+        Get a ReportCheckpoint, for the units of report on host
+        """
+        return ReportCheckpoint(self, host, report)
+
+    def close(self):
+        self._f.close()
+
+    def remove(self):
+        """
+        Close and remove the checkpoint file, once the run it is for has completed
+        """
+        self.close()
+        os.remove(self.path)
+
+
+class ReportCheckpoint(object):
+    """
+    The part of a Checkpoint for a single report on a single host, that the report gets as host.checkpoint
+    """
+    def __init__(self, checkpoint, host, report):
+        self.checkpoint = checkpoint
+        self.host = host
+        self.report = report
+
+    def get(self, key):
+        return self.checkpoint.get(self.host, self.report, key)
+
+    def record(self, key, result):
+        self.checkpoint.record(self.host, self.report, key, result)
@@ -0,0 +1,141 @@
+# Copyright 2015 Yuvi Panda <yuvipanda@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Script to compare the report outputs of two audit runs
+
+Reports are split into findings (see labsdb.auditor.findings), keyed by
+(host, report, db, table), and only what changed between the runs is
+output, as one JSON line per finding:
+
+    {"change": "new", "host": ..., "report": ..., "db": ..., "table": ..., "new": <value>}
+    {"change": "resolved", ..., "old": <value>}
+    {"change": "changed", ..., "old": <value>, "new": <value>}
+
+A host that failed is a finding of the 'error' report. Findings of a host
+that failed in the new run are not reported as resolved, since nothing is
+known about them.
+
+    python -m labsdb.auditor.compare last-report.jsonl report.jsonl
+
+The old report is held in memory, the new one is streamed. Input files can
+be in any of the output formats, and need not both be in the same one.
+"""
+import argparse
+import json
+import logging
+import sys
+from collections import OrderedDict
+
+from labsdb.auditor.findings import REPORT_LAYOUTS, iter_findings
+from labsdb.auditor.output import read_records
+
+
+def _canonical(value):
+    """
+    Get value as a string that is equal for equal values, whatever order their lists are in
+
+    Lists in reports (like missing columns) come from sets, so their order
+    can differ between runs without anything having changed.
+    """
+    def sort_lists(obj):
+        if isinstance(obj, dict):
+            return dict((k, sort_lists(v)) for k, v in obj.items())
+        if isinstance(obj, list):
+            return sorted((sort_lists(v) for v in obj), key=lambda v: json.dumps(v, sort_keys=True))
+        return obj
+    return json.dumps(sort_lists(value), sort_keys=True)
+
+
+def record_findings(record):
+    """
+    Get OrderedDict of (host, report, db, table) -> value, for the findings in a report record
+
+    Reports that can not be split into findings are a single finding with db and table None.
+    """
+    findings = OrderedDict()
+    if 'error' in record:
+        findings[(record['host'], 'error', None, None)] = record['error']
+        return findings
+    if record['name'] not in REPORT_LAYOUTS:
+        if record['report']:
+            findings[(record['host'], record['name'], None, None)] = record['report']
+        return findings
+    for db, table, value in iter_findings(record['name'], record['report']):
+        key = (record['host'], record['name'], db, table)
+        if key in findings and isinstance(findings[key], dict) and isinstance(value, dict):
+            # Several findings about the same table, eg. both violations and incomplete rows checks
+            findings[key] = dict(findings[key], **value)
+        else:
+            findings[key] = value
+    return findings
+
+
+def compare(old_path, new_path):
+    """
+    Yield a change dict for every finding that is new, resolved or changed from old_path to new_path
+    """
+    old = OrderedDict()
+    for record in read_records(old_path):
+        for key, value in record_findings(record).items():
+            old[key] = _canonical(value), value
+
+    failed_hosts = set()
+    for record in read_records(new_path):
+        if 'error' in record:
+            failed_hosts.add(record['host'])
+        for key, value in record_findings(record).items():
+            change = dict(zip(('host', 'report', 'db', 'table'), key))
+            if key not in old:
+                change.update(change='new', new=value)
+                yield change
+                continue
+            old_canonical, old_value = old.pop(key)
+            if old_canonical != _canonical(value):
+                change.update(change='changed', old=old_value, new=value)
+                yield change
+
+    for key, (_, old_value) in old.items():
+        if key[0] not in failed_hosts:
+            change = dict(zip(('host', 'report', 'db', 'table'), key))
+            change.update(change='resolved', old=old_value)
+            yield change
+
+
+def main():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('old_file_path', help='Report output file of the earlier run')
+    argparser.add_argument('new_file_path', help='Report output file of the later run')
+    argparser.add_argument('--output-file-path', help='Path to write changes to, default stdout')
+    argparser.add_argument('--exit-code', action='store_true',
+                           help='Exit with status 1 if there are new or changed findings, like diff')
+    args = argparser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    counts = {'new': 0, 'resolved': 0, 'changed': 0}
+    out = open(args.output_file_path, 'w') if args.output_file_path else sys.stdout
+    try:
+        for change in compare(args.old_file_path, args.new_file_path):
+            counts[change['change']] += 1
+            out.write(json.dumps(change, sort_keys=True) + '\n')
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    logging.info('%s new, %s resolved and %s changed findings', counts['new'], counts['resolved'], counts['changed'])
+    if args.exit_code and (counts['new'] or counts['changed']):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
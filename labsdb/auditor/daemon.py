@@ -0,0 +1,269 @@
+# Copyright 2015 Yuvi Panda <yuvipanda@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Long running version of audit.py, that audits on a schedule
+
+Unlike a cron job running audit.py, the daemon keeps everything that is
+expensive to set up between runs: the Model (reloaded only when a file it
+is built from changes), the view definer parse caches, the pooled
+connections to every host and the Snapshot for incremental runs. The
+latest report and the status of the daemon are served over HTTP:
+
+    GET /status -> JSON with the state of the daemon and its last run
+    GET /report -> JSON list of host reports of the last completed run
+    GET /metrics -> Metrics of all runs so far, in the Prometheus text format
+    POST /run -> Start a run now, instead of waiting for the next scheduled one
+
+    python -m labsdb.auditor.daemon --interval 3600 --listen 127.0.0.1:8098
+"""
+import argparse
+import json
+import logging
+import signal
+import threading
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import yaml
+
+from labsdb.auditor.metrics import REGISTRY
+from labsdb.auditor.modelcache import load_model, model_cache_key
+from labsdb.auditor.output import WRITERS, open_writer
+from labsdb.auditor.reports import register_reports, viewdiffs
+from labsdb.auditor.runner import ReportRunner
+from labsdb.auditor.snapshot import Snapshot
+from labsdb.auditor.utils import SafeLoader
+
+
+class AuditDaemon(object):
+    """
+    Runs all reports against all hosts every interval seconds, keeping caches and connections warm
+    """
+    def __init__(self, config_file_path, interval, state_file_path, model_cache_path=None,
+                 ignore_public_dbs=False, output_file_path=None, output_format='yaml', connect=None):
+        """
+        :param config_file_path: Path to config file, reread before every run
+        :param interval: Seconds from the start of a run to the start of the next one
+        :param output_file_path: Path to also write the report of every run to, None to not
+        :param connect: Function that takes a Host and returns a new connection to it,
+                        defaults to connecting with MySQLdb
+        """
+        self.config_file_path = config_file_path
+        self.interval = interval
+        self.model_cache_path = model_cache_path
+        self.ignore_public_dbs = ignore_public_dbs
+        self.output_file_path = output_file_path
+        self.output_format = output_format
+        self.connect = connect
+        self.snapshot = Snapshot.load(state_file_path)
+        self.hosts = {}
+        self.model = None
+        self.model_key = None
+        self.report = None
+        self.status = {
+            'state': 'starting',
+            'runs': 0,
+            'last_run_start': None,
+            'last_run_end': None,
+            'last_run_seconds': None,
+            'last_run_errors': None,
+            'next_run': None,
+            'model_key': None,
+        }
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+
+    def _set_status(self, **status):
+        with self._lock:
+            self.status.update(status)
+
+    def get_status(self):
+        with self._lock:
+            return dict(self.status)
+
+    def _load(self):
+        """
+        Reload config, and the model if any of the files it is built from changed
+        """
+        with open(self.config_file_path) as cf:
+            config = yaml.load(cf, Loader=SafeLoader)
+        key = model_cache_key(config, self.ignore_public_dbs)
+        if key != self.model_key:
+            logging.info('Model inputs changed, loading model')
+            self.model = load_model(config, self.ignore_public_dbs, self.model_cache_path)
+            self.model_key = key
+            # Everything cached is keyed on digests of tables of the old model
+            viewdiffs.clear_caches()
+        return config
+
+    def run_once(self):
+        """
+        Run all reports once, and make the result the latest report
+        """
+        start_time = time.time()
+        self._set_status(state='running', last_run_start=start_time)
+        try:
+            config = self._load()
+            rr = ReportRunner(config, self.model, self.snapshot, self.connect, hosts=self.hosts)
+            register_reports(rr, config)
+            report = rr.run()
+            self.snapshot.save()
+            if self.output_file_path:
+                writer = open_writer(self.output_file_path, self.output_format)
+                try:
+                    for host_report in report:
+                        for r in host_report['reports']:
+                            writer.write_report(host_report['host'], r['name'], r['report'])
+                        writer.end_host(host_report['host'], host_report.get('error'))
+                finally:
+                    writer.close()
+            with self._lock:
+                self.report = report
+            errors = rr.errors
+        except Exception as e:
+            logging.exception('Audit run failed')
+            errors = {'*': '%s: %s' % (type(e).__name__, e)}
+        elapsed_time = time.time() - start_time
+        REGISTRY.set('labsdb_auditor_last_run_seconds', elapsed_time)
+        REGISTRY.set('labsdb_auditor_last_run_end_timestamp_seconds', time.time())
+        REGISTRY.inc('labsdb_auditor_runs_total')
+        with self._lock:
+            self.status.update(state='idle', runs=self.status['runs'] + 1, last_run_end=time.time(),
+                               last_run_seconds=elapsed_time, last_run_errors=errors, model_key=self.model_key)
+        logging.info('Finished audit run in %s, with %s hosts failing', elapsed_time, len(errors))
+
+    def trigger(self):
+        """
+        Start a run as soon as the current one (if any) has finished
+        """
+        self._wake.set()
+
+    def stop(self):
+        """
+        Stop after the current run (if any) has finished
+        """
+        self._stopping = True
+        self._wake.set()
+
+    def run(self):
+        """
+        Run on schedule until stopped
+        """
+        while not self._stopping:
+            start_time = time.time()
+            self._wake.clear()
+            self.run_once()
+            next_run = start_time + self.interval
+            self._set_status(next_run=next_run)
+            while not self._stopping and not self._wake.is_set() and time.time() < next_run:
+                self._wake.wait(min(next_run - time.time(), 60))
+        for host in self.hosts.values():
+            host.close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+    Serves the status and latest report of self.server.daemon
+    """
+    def _send(self, code, body, content_type='application/json'):
+        body = body.encode('utf-8') if not isinstance(body, bytes) else body
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        daemon = self.server.daemon
+        if self.path == '/status':
+            self._send(200, json.dumps(daemon.get_status(), sort_keys=True))
+        elif self.path == '/report':
+            report = daemon.report
+            if report is None:
+                self._send(503, json.dumps({'error': 'No run has completed yet'}))
+            else:
+                self._send(200, json.dumps(report, sort_keys=True))
+        elif self.path == '/metrics':
+            self._send(200, REGISTRY.to_text(), 'text/plain; version=0.0.4')
+        else:
+            self._send(404, json.dumps({'error': 'Not found'}))
+
+    def do_POST(self):
+        if self.path == '/run':
+            self.server.daemon.trigger()
+            self._send(202, json.dumps({'state': 'triggered'}))
+        else:
+            self._send(404, json.dumps({'error': 'Not found'}))
+
+    def log_message(self, format, *args):
+        logging.debug('HTTP %s: %s', self.address_string(), format % args)
+
+
+def serve(daemon, address):
+    """
+    Serve the HTTP endpoints of daemon on address, in a background thread
+
+    :param address: (host, port) tuple
+    """
+    server = HTTPServer(address, _Handler)
+    server.daemon = daemon
+    thread = threading.Thread(target=server.serve_forever, name='http')
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('--config-file-path', help='Path to config file', default='config.yaml')
+    argparser.add_argument('--interval', type=int, default=3600, help='Seconds between the starts of runs')
+    argparser.add_argument('--listen', default='127.0.0.1:8098', help='HOST:PORT to serve status and reports on')
+    argparser.add_argument('--output-file-path', help='Path to also write the report of every run to')
+    argparser.add_argument('--output-format', choices=sorted(WRITERS), default='yaml',
+                           help='Format of output file, see audit.py')
+    argparser.add_argument('--log-file-path', help='Path to log file', default='audit-daemon.log')
+    argparser.add_argument('--debug', action='store_true', help='Turn on debug logging')
+    argparser.add_argument('--model-cache-path', default='model-cache.pickle',
+                           help='Path to compiled model cache, empty to always build the model from scratch')
+    argparser.add_argument('--ignore-public-dbs', action='store_true',
+                           help='Ignore public dbs (useful for running against sanitarium)')
+    argparser.add_argument('--state-file-path', default='audit-state.json',
+                           help='Path to snapshot of the last run, for incremental audits')
+    args = argparser.parse_args()
+
+    logging.basicConfig(filename=args.log_file_path,
+                        level=logging.DEBUG if args.debug else logging.INFO,
+                        format='%(asctime)s: %(message)s')
+
+    daemon = AuditDaemon(args.config_file_path, args.interval, args.state_file_path, args.model_cache_path or None,
+                         args.ignore_public_dbs, args.output_file_path, args.output_format)
+    listen_host, listen_port = args.listen.rsplit(':', 1)
+    server = serve(daemon, (listen_host, int(listen_port)))
+    signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+    logging.info('Serving on %s, auditing every %s seconds', args.listen, args.interval)
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+# Copyright 2015 Yuvi Panda <yuvipanda@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+In process stand in for a labsdb host, for running reports without one
+
+A FakeCluster is generated from a Model, with every view defined the way
+the model says it should be, plus optional injected drift. FakeConnections
+to it understand just the queries that the reports issue.
+"""
+import hashlib
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import MySQLdb
+
+from labsdb.auditor.metrics import statement_type
+from labsdb.auditor.models import FrozenColumn, FrozenTable
+from labsdb.auditor.viewsql import render_view_definition
+
+_IN_LIST_RE = re.compile(r"IN \((.*?)\)")
+
+
+class FakeCluster(object):
+    """
+    The databases, tables and view definitions of a synthetic labsdb host
+    """
+    def __init__(self, model, tables_per_wiki=None, drift=0.0, latency=0.0, seed=0):
+        """
+        :param model: Model to generate the cluster from, one wiki per private db in it
+        :param tables_per_wiki: Number of model tables (in name order) to create in every wiki, None for all
+        :param drift: Fraction of views to define differently from the model, and of
+                      wikis to have an extra table in, or to be missing entirely
+        :param latency: Seconds every query takes
+        :param seed: Seed for picking what drifts
+        """
+        self.latency = latency
+        self.query_counts = {}
+        # Health the cluster reports, change these to see how the Scheduler reacts
+        self.replication_lag = 0
+        self.threads_running = 1
+        self._lock = threading.Lock()
+        rand = random.Random(seed)
+
+        table_names = sorted(model.tables)[:tables_per_wiki]
+        self.tables = {}  # db -> list of tables (including views)
+        self.views = {}  # db -> dict of view name -> definition
+        self.databases = ['information_schema', 'p50380g50592__test', 'u2170__scratch']
+        for private_db, public_db in zip(model.private_dbs, model.public_dbs or [None] * len(model.private_dbs)):
+            if rand.random() < drift:
+                continue  # Missing wiki
+            self.databases.append(private_db)
+            self.tables[private_db] = list(table_names)
+            if public_db is None:
+                continue
+            self.databases.append(public_db)
+            self.views[public_db] = dict((name, render_view_definition(self._drift(model.tables[name], rand, drift),
+                                                                       private_db))
+                                         for name in table_names)
+            self.tables[public_db] = list(table_names)
+            if rand.random() < drift:
+                self.tables[public_db].append('drifted_extra_table')
+        self.databases.sort()
+
+    @staticmethod
+    def _drift(table, rand, drift):
+        """
+        Randomly (with probability drift) get a differently defined version of table
+        """
+        if not table.columns or rand.random() >= drift:
+            return table
+        columns = OrderedDict(table.columns)
+        name = rand.choice(sorted(columns))
+        column = columns[name]
+        if column.whitelisted:
+            # Nulled out when it should not be
+            columns[name] = FrozenColumn(name, False, None)
+        elif len(columns) > 1:
+            # Sanitized column dropped from the view
+            del columns[name]
+        else:
+            # Sanitized column exposed as is
+            columns[name] = FrozenColumn(name)
+        return FrozenTable(table.name, columns, table.include_row_if, table.table_name)
+
+    def connect(self, host=None):
+        """
+        Get a new FakeConnection to this cluster. Usable as the connect argument of Host / ReportRunner
+        """
+        return FakeConnection(self)
+
+    def count_query(self, sql):
+        with self._lock:
+            statement = statement_type(sql)
+            self.query_counts[statement] = self.query_counts.get(statement, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class FakeConnection(object):
+    def __init__(self, cluster):
+        self.cluster = cluster
+        self.db = None
+
+    def cursor(self, cursorclass=None):
+        return FakeCursor(self)
+
+    def ping(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeCursor(object):
+    """
+    Cursor that answers the queries the reports issue from a FakeCluster
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        self.cluster = conn.cluster
+        self.rows = []
+        self.description = None
+
+    def execute(self, sql, args=None):
+        self.cluster.count_query(sql)
+        cluster = self.cluster
+        self.description = None
+        if args is not None:
+            sql = sql % tuple("'%s'" % a for a in args)
+        if sql == 'SHOW DATABASES':
+            self.rows = [(db, ) for db in cluster.databases]
+        elif sql.startswith('USE '):
+            db = sql[4:].strip()
+            if db not in cluster.tables:
+                raise MySQLdb.OperationalError(1049, "Unknown database '%s'" % db)
+            self.conn.db = db
+            self.rows = []
+        elif sql == 'SHOW TABLES':
+            self.rows = [(name, ) for name in cluster.tables[self.conn.db]]
+        elif sql.startswith('SHOW CREATE VIEW '):
+            db, name = sql.split()[-1].split('.')
+            self.rows = [(name, 'CREATE ALGORITHM=UNDEFINED DEFINER=`viewmaster`@`%%` SQL SECURITY DEFINER '
+                                'VIEW `%s` AS %s' % (name, cluster.views[db][name]))]
+        elif sql == 'SHOW ALL SLAVES STATUS':
+            # A multi source replica, like labsdb hosts are, with only one of its sources lagging
+            self.description = (('Connection_name', ), ('Slave_IO_State', ), ('Seconds_Behind_Master', ))
+            self.rows = [('s1', 'Waiting for master to send event', 0),
+                         ('s2', 'Waiting for master to send event', cluster.replication_lag)]
+        elif sql == 'SHOW SLAVE STATUS':
+            # Only the default connection, which multi source replicas do not use
+            self.description = (('Slave_IO_State', ), ('Seconds_Behind_Master', ))
+            self.rows = []
+        elif sql == "SHOW GLOBAL STATUS LIKE 'Threads_running'":
+            self.rows = [('Threads_running', str(cluster.threads_running))]
+        elif 'information_schema.SCHEMATA' in sql:
+            self.rows = [(db, ) for db in cluster.databases]
+        elif 'information_schema.TABLES' in sql:
+            self.rows = [(db, name, 'VIEW' if name in cluster.views.get(db, {}) else 'BASE TABLE')
+                         for db in self._schemas(sql) for name in cluster.tables[db]]
+        elif 'information_schema.VIEWS' in sql and 'GROUP BY TABLE_SCHEMA' in sql:
+            self.rows = []
+            for db in self._schemas(sql):
+                views = cluster.views.get(db, {})
+                if views:
+                    checksum = 0
+                    for name, definition in views.items():
+                        view_hash = hashlib.md5(('%s:%s' % (name, definition)).encode('utf-8')).hexdigest()
+                        checksum ^= int(view_hash[:16], 16)
+                    self.rows.append((db, len(views), checksum))
+        elif 'information_schema.VIEWS' in sql:
+            with_definitions = ', VIEW_DEFINITION' in sql
+            self.rows = []
+            for db in self._schemas(sql):
+                for name, definition in sorted(cluster.views.get(db, {}).items()):
+                    row = (db, name, hashlib.md5(definition.encode('utf-8')).hexdigest())
+                    self.rows.append(row + (definition, ) if with_definitions else row)
+        else:
+            raise MySQLdb.OperationalError(1064, 'FakeCursor does not understand %s' % sql)
+
+    def _schemas(self, sql):
+        """
+        dbs that the TABLE_SCHEMA IN (...) condition of sql selects, or all of them
+        """
+        match = _IN_LIST_RE.search(sql)
+        if not match:
+            return sorted(self.cluster.tables)
+        dbs = [db.strip().strip("'") for db in match.group(1).split(',')]
+        return [db for db in dbs if db in self.cluster.tables]
+
+    def fetchall(self):
+        return list(self.rows)
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def close(self):
+        pass
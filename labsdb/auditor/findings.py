@@ -0,0 +1,129 @@
+# Copyright 2015 Yuvi Panda <yuvipanda@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Splitting of reports into findings about single dbs and tables, and back
+
+A finding is a (db, table, value) tuple, where table is None for findings
+about a whole db. The layout of each report says which levels of its
+nested dicts are keyed by db or table:
+
+    - 'db' -> dict keyed by db
+    - 'table' -> dict keyed by table
+    - 'dbs' -> list of dbs, always the last level
+    - None -> dict with fixed keys (like extra_dbs), that are kept in the value
+
+What is left of a report once its findings are taken out is its skeleton,
+eg. {'extra_tables_public_dbs': {}, 'extra_tables_private_dbs': {}}. Reports
+without a layout are all skeleton.
+"""
+import copy
+
+REPORT_LAYOUTS = {
+    'databases_report': (None, 'dbs'),
+    'extra_tables_report': (None, 'table', 'dbs'),
+    'views_schema_diff_report': ('db', 'table'),
+    'sanitized_rows_report': ('db', None, 'table'),
+}
+
+
+def _wrap(keys, value):
+    for key in reversed(keys):
+        value = {key: value}
+    return value
+
+
+def _iter_level(layout, node, db, table, keys):
+    if not layout:
+        yield db, table, _wrap(keys, node)
+        return
+    level, rest = layout[0], layout[1:]
+    if level == 'dbs':
+        for item in node:
+            for finding in _iter_level(rest, None, item, table, keys):
+                yield finding
+        return
+    for key, child in node.items():
+        if level == 'db':
+            findings = _iter_level(rest, child, key, table, keys)
+        elif level == 'table':
+            findings = _iter_level(rest, child, db, key, keys)
+        else:
+            findings = _iter_level(rest, child, db, table, keys + [key])
+        for finding in findings:
+            yield finding
+
+
+def iter_findings(name, report):
+    """
+    Yield (db, table, value) for every finding in report name
+    """
+    layout = REPORT_LAYOUTS.get(name)
+    if layout is None:
+        return iter(())
+    return _iter_level(layout, report, None, None, [])
+
+
+def _skeleton_level(layout, node):
+    if layout[0] is None:
+        return dict((key, _skeleton_level(layout[1:], child)) for key, child in node.items())
+    return [] if layout[0] == 'dbs' else {}
+
+
+def skeleton(name, report):
+    """
+    Get what is left of report name once its findings are taken out
+    """
+    layout = REPORT_LAYOUTS.get(name)
+    if layout is None:
+        return report
+    return _skeleton_level(layout, report)
+
+
+def _insert(layout, node, db, table, value):
+    for i, level in enumerate(layout):
+        if level == 'dbs':
+            node.append(db)
+            return
+        if level is None:
+            key, value = next(iter(value.items()))
+        else:
+            key = db if level == 'db' else table
+        if i == len(layout) - 1:
+            node[key] = copy.deepcopy(value)
+        else:
+            node = node.setdefault(key, [] if layout[i + 1] == 'dbs' else {})
+
+
+def _sort_dbs(layout, node):
+    if layout[0] == 'dbs':
+        node.sort()
+    elif len(layout) > 1:
+        for child in node.values():
+            _sort_dbs(layout[1:], child)
+
+
+def build_report(name, report_skeleton, findings):
+    """
+    Put report name back together from its skeleton and its findings
+
+    Lists of dbs come out sorted, the way the reports generate them.
+    """
+    report = copy.deepcopy(report_skeleton)
+    layout = REPORT_LAYOUTS.get(name)
+    if layout is None:
+        return report
+    for db, table, value in findings:
+        _insert(layout, report, db, table, value)
+    _sort_dbs(layout, report)
+    return report
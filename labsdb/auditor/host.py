@@ -0,0 +1,213 @@
+# Copyright 2015 Yuvi Panda <yuvipanda@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+A labsdb host that reports are run against
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+
+import MySQLdb
+
+from labsdb.auditor.catalog import Catalog
+from labsdb.auditor.metrics import REGISTRY, InstrumentedConnection
+from labsdb.auditor.scheduler import Scheduler
+
+# MySQL error codes of OperationalErrors that are worth retrying on a new connection:
+# too many connections, server shutdown, lock wait timeout, deadlock, can't connect,
+# server has gone away and lost connection
+TRANSIENT_ERRORS = frozenset([1040, 1053, 1205, 1213, 2003, 2006, 2013])
+
+# Pooled connections idle for longer than this many seconds are pinged before
+# being reused, since the server may have closed them in the meantime (eg.
+# between runs of the daemon)
+IDLE_PING_AFTER = 10
+
+
+class Host(object):
+    """
+    A labsdb host, with a bounded pool of connections to it
+
+    Reports get one of these instead of a bare connection, so that they can
+    spread their per database work over up to config['db-parallelism']
+    connections (fewer when self.scheduler finds the host struggling),
+    and share the Catalog of the host in self.catalog. For incremental
+    audits, self.snapshot has the host's dict from the Snapshot of the last
+    run, which reports can reuse results from and update. For resumable runs,
+    self.checkpoint has the ReportCheckpoint of the report being run.
+    self.parse_pool is the multiprocessing.Pool shared by all hosts for
+    parsing view definers, None if there is none.
+    """
+    def __init__(self, config, connect=None):
+        """
+        :param config: Config for this host, with the 'host' key set to 'hostname[:port]'
+        :param connect: Function that takes a Host and returns a new connection to it,
+                        defaults to connecting with MySQLdb
+        """
+        self.config = config
+        self._connect = connect
+        self.name = config['host']
+        if ':' in self.name:
+            self.hostname, port = self.name.split(':')
+        else:
+            self.hostname, port = self.name, 3306
+        self.port = int(port)
+        self.parallelism = max(config.get('db-parallelism', 1), 1)
+        self._idle = []  # (connection, time it went idle)
+        self._lock = threading.Lock()
+        self.scheduler = Scheduler(self, config)
+        self.catalog = None
+        self.snapshot = None
+        self.checkpoint = None
+        self.parse_pool = None
+
+    def connect(self, pace=None):
+        """
+        Open a new connection to this host, outside of the pool
+
+        Every query on it is recorded in the metrics REGISTRY.
+
+        :param pace: Function to call before every query on the connection
+        """
+        if self._connect is not None:
+            conn = self._connect(self)
+        else:
+            conn = MySQLdb.connect(host=self.hostname, port=self.port, read_default_file='~/.my.cnf')
+        return InstrumentedConnection(conn, self.name, pace)
+
+    def load_catalog(self, dbs=None):
+        """
+        (Re)load the Catalog of databases and tables on this host
+
+        :param dbs: Databases to load the tables of, None for all of them
+        """
+        self.catalog = self.retrying(Catalog.load, dbs, self.config.get('view-fetch-batch-size', 100))
+        return self.catalog
+
+    @contextmanager
+    def connection(self):
+        """
+        Check out a connection from the pool for the duration of the with block
+
+        Blocks while all connections the scheduler allows are in use, so
+        do not call map() or connection() again from inside the block. If the
+        block raises, the connection is closed instead of going back to the
+        pool, since it may be broken or have a query still in progress on it.
+        """
+        self.scheduler.acquire()
+        try:
+            conn = self._pop_idle()
+            if conn is None:
+                conn = self.connect(self.scheduler.pace)
+            try:
+                yield conn
+            except BaseException:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+                raise
+            with self._lock:
+                self._idle.append((conn, time.time()))
+        finally:
+            self.scheduler.release()
+
+    def _pop_idle(self):
+        """
+        Get a working idle connection from the pool, None if there are none
+
+        Connections that have been idle for a while are pinged first, and
+        closed if they are dead, so that failures on them do not use up the
+        retries of the query they would have been used for.
+        """
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                conn, idle_since = self._idle.pop()
+            if time.time() - idle_since < IDLE_PING_AFTER:
+                return conn
+            try:
+                conn.ping()
+                return conn
+            except MySQLdb.Error:
+                logging.info('Dropping dead pooled connection to %s', self.name)
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+
+    def retrying(self, func, *args):
+        """
+        Call func(conn, *args) with a pooled connection, retrying on a new connection on transient errors
+
+        Retries up to config['query-retries'] times, waiting config['retry-backoff']
+        seconds before the first retry and twice as long before each next one.
+        func has to be safe to call again after it failed halfway.
+        """
+        retries = self.config.get('query-retries', 3)
+        backoff = self.config.get('retry-backoff', 1.0)
+        for attempt in range(retries + 1):
+            try:
+                with self.connection() as conn:
+                    return func(conn, *args)
+            except MySQLdb.OperationalError as e:
+                if attempt == retries or e.args[0] not in TRANSIENT_ERRORS:
+                    raise
+                logging.warning('Transient error on %s, retrying in %s seconds: %s', self.name, backoff, e)
+                REGISTRY.inc('labsdb_auditor_retries_total', host=self.name)
+                time.sleep(backoff)
+                backoff *= 2
+
+    def map(self, func, items):
+        """
+        Call func(conn, item) for every item, using up to config['db-parallelism'] pooled connections
+
+        Items that fail with transient errors are retried, see retrying().
+
+        Time spent on every item is recorded in the metrics REGISTRY, per db
+        if items are db names, and as a histogram otherwise.
+
+        :return: List of results, in the same order as items
+        """
+        def run(item):
+            start_time = time.time()
+            result = self.retrying(func, item)
+            if isinstance(item, str):
+                REGISTRY.set('labsdb_auditor_db_seconds', time.time() - start_time, host=self.name, db=item)
+            else:
+                REGISTRY.observe('labsdb_auditor_batch_seconds', time.time() - start_time, host=self.name)
+            return result
+
+        parallelism = min(self.parallelism, len(items))
+        if parallelism <= 1:
+            return [run(item) for item in items]
+        workers = ThreadPool(parallelism)
+        try:
+            return workers.map(run, items)
+        finally:
+            workers.close()
+            workers.join()
+
+    def close(self):
+        """
+        Close all pooled connections, and the one the scheduler checks health on
+        """
+        self.scheduler.close()
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            conn.close()
@@ -0,0 +1,91 @@
+# Copyright 2015 Yuvi Panda <yuvipanda@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Script to merge the report outputs of sharded audit runs into one
+
+Every shard reports on a disjoint set of dbs, so the reports of a host are
+merged by combining their dicts, and concatenating and sorting their lists
+of dbs. The result is the same as what an unsharded run would have output.
+
+    python -m labsdb.auditor.merge --output-file-path report.yaml report-*of8.yaml
+
+Input files can be in any of the output formats, and need not all be in
+the same one.
+"""
+import argparse
+from collections import OrderedDict
+
+from labsdb.auditor.output import WRITERS, open_writer, read_records
+
+
+def merge_reports(a, b):
+    """
+    Merge report b of one shard into report a of another
+
+    :return: The merged report. Neither a nor b are modified.
+    """
+    if isinstance(a, dict) and isinstance(b, dict):
+        merged = dict(a)
+        for key, value in b.items():
+            merged[key] = merge_reports(a[key], value) if key in a else value
+        return merged
+    if isinstance(a, list) and isinstance(b, list):
+        return sorted(a + b)
+    if a != b:
+        raise ValueError('Conflicting values %r and %r in shard reports' % (a, b))
+    return a
+
+
+def merge_records(paths):
+    """
+    Merge the records of report output files of every shard
+
+    :return: OrderedDict of host -> (OrderedDict of report name -> report, list of errors),
+             in the order the hosts and reports were first seen
+    """
+    hosts = OrderedDict()
+    for path in paths:
+        for record in read_records(path):
+            reports, errors = hosts.setdefault(record['host'], (OrderedDict(), []))
+            if 'error' in record:
+                if record['error'] not in errors:
+                    errors.append(record['error'])
+            elif record['name'] in reports:
+                reports[record['name']] = merge_reports(reports[record['name']], record['report'])
+            else:
+                reports[record['name']] = record['report']
+    return hosts
+
+
+def main():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('input_file_paths', nargs='+', metavar='INPUT_FILE_PATH',
+                           help='Report output files of all the shards')
+    argparser.add_argument('--output-file-path', help='Path to merged report output file', default='report.yaml')
+    argparser.add_argument('--output-format', choices=sorted(WRITERS), default='yaml',
+                           help='Format of merged report output file, see audit.py')
+    args = argparser.parse_args()
+
+    writer = open_writer(args.output_file_path, args.output_format)
+    try:
+        for host, (reports, errors) in merge_records(args.input_file_paths).items():
+            for name, report in reports.items():
+                writer.write_report(host, name, report)
+            writer.end_host(host, '; '.join(errors) if errors else None)
+    finally:
+        writer.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+# Copyright 2015 Yuvi Panda <yuvipanda@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Metrics about where the time of an audit goes
+
+Everything is recorded in the module level REGISTRY, and written out at the
+end of a run in the Prometheus textfile collector format.
+"""
+import functools
+import os
+import re
+import threading
+import time
+
+# Upper bounds of histogram buckets, in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0, float('inf'))
+
+
+def statement_type(sql):
+    """
+    Short name for the kind of statement sql is, to group queries by
+    """
+    if 'information_schema.' in sql:
+        return 'information_schema.' + re.search(r'information_schema\.(\w+)', sql).group(1)
+    words = sql.split()
+    if words[0] == 'SHOW':
+        return ' '.join(words[:3] if words[1] == 'CREATE' else words[:2])
+    return words[0]
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                             for k, v in labels)
+
+
+class Metrics(object):
+    """
+    Thread safe registry of counters, gauges and histograms, each with labels
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}  # (name, labels) -> value
+        self.gauges = {}  # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [bucket counts, sum, count]
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * len(BUCKETS), 0.0, 0]
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def get(self, name, **labels):
+        """
+        Get current value of a counter
+        """
+        return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def clear(self):
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+    def to_text(self):
+        """
+        Render all metrics in the Prometheus text exposition format
+        """
+        lines = []
+        with self._lock:
+            for kind, metrics in (('counter', self.counters), ('gauge', self.gauges)):
+                last_name = None
+                for (name, labels), value in sorted(metrics.items()):
+                    if name != last_name:
+                        lines.append('# TYPE %s %s' % (name, kind))
+                        last_name = name
+                    lines.append('%s%s %s' % (name, _format_labels(labels), value))
+            last_name = None
+            for (name, labels), (buckets, total, count) in sorted(self.histograms.items()):
+                if name != last_name:
+                    lines.append('# TYPE %s histogram' % name)
+                    last_name = name
+                for bound, bucket_count in zip(BUCKETS, buckets):
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append('%s_bucket%s %s' % (name, _format_labels(labels + (('le', le), )), bucket_count))
+                lines.append('%s_sum%s %s' % (name, _format_labels(labels), total))
+                lines.append('%s_count%s %s' % (name, _format_labels(labels), count))
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        """
+        Atomically write all metrics to path, for the node exporter's textfile collector
+        """
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(self.to_text())
+        os.rename(tmp_path, path)
+
+
+REGISTRY = Metrics()
+
+
+def timed(function_name):
+    """
+    Decorator that counts calls of and seconds spent in the decorated function
+
+    Recorded as labsdb_auditor_function_calls_total and
+    labsdb_auditor_function_seconds_total, with a function label.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start_time = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                REGISTRY.inc('labsdb_auditor_function_seconds_total', time.time() - start_time,
+                             function=function_name)
+                REGISTRY.inc('labsdb_auditor_function_calls_total', function=function_name)
+        return wrapper
+    return decorator
+
+
+class InstrumentedConnection(object):
+    """
+    Wraps a connection, to record count and latency of every query by statement type
+    """
+    def __init__(self, conn, host, pace=None):
+        """
+        :param pace: Function to call before every query, eg. to wait before issuing it
+        """
+        self._conn = conn
+        self.host = host
+        self.pace = pace
+
+    def cursor(self, *args):
+        return InstrumentedCursor(self._conn.cursor(*args), self.host, self.pace)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class InstrumentedCursor(object):
+    """
+    Cursor that records every query it executes
+
+    For unbuffered cursors, only the time until the first row is ready is
+    recorded, since the rest is streamed while iterating.
+    """
+    def __init__(self, cursor, host, pace=None):
+        self._cursor = cursor
+        self.host = host
+        self.pace = pace
+
+    def execute(self, sql, args=None):
+        if self.pace is not None:
+            self.pace()
+        start_time = time.time()
+        try:
+            return self._cursor.execute(sql, args)
+        finally:
+            statement = statement_type(sql)
+            REGISTRY.inc('labsdb_auditor_queries_total', host=self.host, statement=statement)
+            REGISTRY.observe('labsdb_auditor_query_seconds', time.time() - start_time,
+                             host=self.host, statement=statement)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
@@ -0,0 +1,137 @@
+# Copyright 2015 Yuvi Panda <yuvipanda@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Loading of the Model, with a compiled cache of it for fast startup
+
+Parsing the tableschema YAML files and building every Table is by far the
+slowest part of starting up, so the fully built Model is pickled to a cache
+file. The cache is keyed on the contents of every file the Model is built
+from, so it is rebuilt whenever any of them changes.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import time
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import yaml
+
+from labsdb.auditor.models import Model, Table
+from labsdb.auditor.utils import OrderedSafeLoader, diff_iters
+
+# Bump when the pickled format of Model changes, to invalidate old caches
+CACHE_VERSION = 3
+
+
+def model_input_paths(config):
+    """
+    Get list of paths of all the files the Model is built from
+    """
+    mwconf_path = config['mediawiki-config-path']
+    return list(config['tableschema-files']) + [
+        os.path.join(mwconf_path, 'all.dblist'),
+        os.path.join(mwconf_path, 'private.dblist'),
+    ]
+
+
+def model_cache_key(config, ignore_public_dbs):
+    """
+    Key identifying the Model built from the current contents of all input files
+    """
+    key = hashlib.sha1(('%s:%s' % (CACHE_VERSION, ignore_public_dbs)).encode('utf-8'))
+    for path in model_input_paths(config):
+        with open(path, 'rb') as f:
+            key.update(path.encode('utf-8'))
+            key.update(hashlib.sha1(f.read()).digest())
+    return key.hexdigest()
+
+
+def load_tables(paths):
+    """
+    Load the tables of all the tableschema files at paths
+
+    Columns of every table are kept in the order the tableschema lists them.
+
+    :return: dict of table name -> FrozenTable
+    """
+    tables = {}
+    for ts_path in paths:
+        with open(ts_path) as ts:
+            tableschema = yaml.load(ts, Loader=OrderedSafeLoader)
+        for tablename, tabledict in tableschema.items():
+            tables[tablename] = Table.from_dict(tablename, tabledict).freeze()
+    return tables
+
+
+def build_model(config, ignore_public_dbs=False):
+    """
+    Build the Model from the tableschema files and the dblists in mediawiki-config
+    """
+    tables = load_tables(config['tableschema-files'])
+
+    all_dblist_path, private_dblist_path = model_input_paths(config)[-2:]
+    with open(all_dblist_path) as all_file, open(private_dblist_path) as priv_file:
+        all_wiki_dbs = [line.strip() for line in all_file.readlines()]
+        priv_wiki_dbs = [line.strip() for line in priv_file.readlines()]
+        dbs, _ = diff_iters(all_wiki_dbs, priv_wiki_dbs)
+
+    # Sorted, so that reports list dbs in the same order however the dbs are sharded
+    private_dbs = sorted(dbs)
+    public_dbs = [db + '_p' for db in private_dbs] if not ignore_public_dbs else []
+
+    return Model(private_dbs, public_dbs, tables)
+
+
+def load_model(config, ignore_public_dbs=False, cache_path=None):
+    """
+    Load the Model, from the compiled cache at cache_path if it is up to date
+
+    Otherwise the Model is built from scratch and the cache is (re)written.
+
+    :param cache_path: Path to the compiled model cache, None to not use a cache
+    """
+    start_time = time.time()
+    if cache_path is None:
+        model = build_model(config, ignore_public_dbs)
+        logging.info('Loaded model without cache in %s', time.time() - start_time)
+        return model
+
+    key = model_cache_key(config, ignore_public_dbs)
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'rb') as f:
+                cached = pickle.load(f)
+            if cached['key'] == key:
+                logging.info('Loaded model from cache %s (warm) in %s', cache_path, time.time() - start_time)
+                return cached['model']
+        except Exception:
+            logging.exception('Ignoring unreadable model cache %s', cache_path)
+
+    model = build_model(config, ignore_public_dbs)
+    # A temporary file of its own, since several shards may be writing the same cache at once
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path) or '.', prefix='.model-cache-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump({'key': key, 'model': model}, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, cache_path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    logging.info('Built model and wrote cache %s (cold) in %s', cache_path, time.time() - start_time)
+    return model
@@ -14,6 +14,43 @@
 """
 Contains classes that Model how LabsDB should be
 """
+import hashlib
+from collections import OrderedDict
+
+from labsdb.auditor.utils import db_shard
+
+
+def _digest_part(value):
+    """
+    Encode a single str / unicode / bool / None value unambiguously for hashing
+    """
+    if value is None:
+        return b'N'
+    if value is True or value is False:
+        return b'T' if value else b'F'
+    if not isinstance(value, bytes):
+        value = value.encode('utf-8')
+    return b'S%d:%s' % (len(value), value)
+
+
+def table_digest(name, include_row_if, table_name, columns):
+    """
+    Structural digest of a table
+
+    Two tables have the same digest if and only if diffing them finds no
+    differences, so this can be used to skip the detailed diff.
+
+    :param columns: dict of column name -> Column / FrozenColumn
+    :return: hex digest string
+    """
+    digest = hashlib.sha1()
+    for value in (name, include_row_if, table_name):
+        digest.update(_digest_part(value))
+    for colname in sorted(columns):
+        column = columns[colname]
+        for value in (column.name, column.whitelisted, column.null_if):
+            digest.update(_digest_part(value))
+    return digest.hexdigest()
 
 
 class Column(object):
@@ -38,16 +75,39 @@ class Column(object):
         self.whitelisted = whitelisted
         self.null_if = null_if
 
+    def freeze(self):
+        """
+        Get an immutable FrozenColumn with the same contents as this column
+        """
+        return FrozenColumn(self.name, self.whitelisted, self.null_if)
 
-class Table(object):
-    def __init__(self, name, columns={}, include_row_if=None, table_name=None):
-        self.name = name
-        self.columns = columns
-        self.include_row_if = include_row_if
-        self.table_name = table_name if table_name else name
 
-    def add_column(self, column):
-        self.columns[column.name] = column
+class FrozenColumn(object):
+    """
+    Immutable, compact version of Column
+    """
+    __slots__ = ('name', 'whitelisted', 'null_if')
+
+    def __init__(self, name, whitelisted=True, null_if=None):
+        object.__setattr__(self, 'name', name)
+        object.__setattr__(self, 'whitelisted', whitelisted)
+        object.__setattr__(self, 'null_if', null_if)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('FrozenColumn is immutable')
+
+    def __reduce__(self):
+        return FrozenColumn, (self.name, self.whitelisted, self.null_if)
+
+    def freeze(self):
+        return self
+
+
+class _BaseTable(object):
+    """
+    Methods shared by Table and FrozenTable
+    """
+    __slots__ = ()
 
     def to_dict(self):
         """
@@ -58,7 +118,7 @@ class Table(object):
             tabledict['include_row_if'] = self.include_row_if
         if all([c.whitelisted for c in self.columns.values()]):
             # Everything is whitelisted!
-            tabledict['columns'] = [c.name for c in self.columns]
+            tabledict['columns'] = [c.name for c in self.columns.values()]
         else:
             tabledict['columns'] = {}
             for c in self.columns.values():
@@ -71,21 +131,89 @@ class Table(object):
             tabledict['table_name'] = self.table_name
         return tabledict
 
+
+class Table(_BaseTable):
+    def __init__(self, name, columns=None, include_row_if=None, table_name=None):
+        """
+        :param columns: dict of column name -> Column, in the order the view lists
+                        them if it is an OrderedDict
+        """
+        self.name = name
+        self.columns = columns if columns is not None else OrderedDict()
+        self.include_row_if = include_row_if
+        self.table_name = table_name if table_name else name
+
+    def add_column(self, column):
+        self.columns[column.name] = column
+
+    @property
+    def digest(self):
+        """
+        Structural digest of this table, see table_digest
+        """
+        return table_digest(self.name, self.include_row_if, self.table_name, self.columns)
+
+    def freeze(self):
+        """
+        Get an immutable FrozenTable with the same contents as this table
+        """
+        columns = OrderedDict((name, column.freeze()) for name, column in self.columns.items())
+        return FrozenTable(self.name, columns, self.include_row_if, self.table_name)
+
     @classmethod
     def from_dict(cls, tablename, tabledata):
-        table = cls(tablename, {}, tabledata.get('include_row_if', None), tabledata.get('table_name', None))
+        table = cls(tablename, OrderedDict(), tabledata.get('include_row_if', None), tabledata.get('table_name', None))
         if isinstance(tabledata['columns'], list):
             # Whitelisted table
             for colname in tabledata['columns']:
                 table.add_column(Column(colname))
         else:
-            # Greylisted table!
+            # Greylisted table! Columns are only in order if tabledata['columns'] is an OrderedDict
             for colname, coldata in tabledata['columns'].items():
                 col = Column(colname, coldata.get('whitelisted'), coldata.get('null_if'))
                 table.add_column(col)
         return table
 
 
+class FrozenTable(_BaseTable):
+    """
+    Immutable, compact version of Table, with its digest precomputed
+
+    Equal to another FrozenTable if their digests are the same, whatever
+    order their columns are in. The columns dict must not be modified.
+    """
+    __slots__ = ('name', 'columns', 'include_row_if', 'table_name', 'digest')
+
+    def __init__(self, name, columns, include_row_if=None, table_name=None):
+        """
+        :param columns: dict of column name -> FrozenColumn
+        """
+        table_name = table_name if table_name else name
+        object.__setattr__(self, 'name', name)
+        object.__setattr__(self, 'columns', columns)
+        object.__setattr__(self, 'include_row_if', include_row_if)
+        object.__setattr__(self, 'table_name', table_name)
+        object.__setattr__(self, 'digest', table_digest(name, include_row_if, table_name, columns))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('FrozenTable is immutable')
+
+    def __reduce__(self):
+        return FrozenTable, (self.name, self.columns, self.include_row_if, self.table_name)
+
+    def __eq__(self, other):
+        return isinstance(other, FrozenTable) and self.digest == other.digest
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.digest)
+
+    def freeze(self):
+        return self
+
+
 class Model(object):
     """
     A complete model of how a labsdb should be.
@@ -93,8 +221,35 @@ class Model(object):
     Contains:
         - List of dbs that should exist (list)
         - List of tables that can exist in any db (dict with tablename as key)
+        - Shard of all dbs the model is restricted to, as (index, count), or None
     """
-    def __init__(self, private_dbs, public_dbs, tables):
+    def __init__(self, private_dbs, public_dbs, tables, shard=None):
         self.private_dbs = private_dbs
         self.public_dbs = public_dbs
         self.tables = tables
+        self.shard = shard
+
+    def in_shard(self, db):
+        """
+        Check if db (whether in the model or not) belongs to the shard of this model
+        """
+        return self.shard is None or db_shard(db, self.shard[1]) == self.shard[0]
+
+    @property
+    def digest(self):
+        """
+        Structural digest of all the tables in this model, equal for models whose tables diff the same
+        """
+        digests = ''.join(sorted(table.digest for table in self.tables.values()))
+        return hashlib.sha1(digests.encode('utf-8')).hexdigest()
+
+    def sharded(self, index, count):
+        """
+        Get a Model of only the dbs in shard index (1 based) out of count shards
+
+        See labsdb.auditor.utils.db_shard for how dbs are assigned to shards.
+        """
+        model = Model([], [], self.tables, (index, count))
+        model.private_dbs = [db for db in self.private_dbs if model.in_shard(db)]
+        model.public_dbs = [db for db in self.public_dbs if model.in_shard(db)]
+        return model
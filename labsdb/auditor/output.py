@@ -0,0 +1,321 @@
+# Copyright 2015 Yuvi Panda <yuvipanda@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Writing (and reading back) of report output
+
+Reports are written out as soon as they are generated, instead of all at
+the end of the run. The formats are:
+
+    - yaml -> A single YAML list with one item per host, with its reports
+              (the original format). Each host is written once it and all
+              hosts before it in config order have finished.
+    - yaml-stream -> One YAML document per record
+    - jsonl -> One JSON object per line, one line per record
+    - compact -> JSON lines with every distinct finding once, with the hosts
+                 and dbs it was found on, see CompactWriter. Written when
+                 the run ends (or after every host, with flush)
+
+A record is a dict of either {host, name, report} for a report on a host,
+or {host, error} for a host that failed.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import yaml
+
+from labsdb.auditor.findings import build_report, iter_findings, skeleton
+from labsdb.auditor.utils import Dumper, SafeLoader, json_loads
+
+COMPACT_VERSION = 1
+
+
+class ReportWriter(object):
+    """
+    Base class for writers, that get report records from the ReportRunner as they are generated
+
+    Can be used from multiple threads at once.
+    """
+    def __init__(self, f, flush=False):
+        """
+        :param f: File object to write to
+        :param flush: Flush and fsync after every record, so that partial
+                      results survive the process (or the machine) dying
+        """
+        self.f = f
+        self.flush = flush
+        self._lock = threading.Lock()
+
+    def start(self, hosts):
+        """
+        Called before any reports are generated, with the names of all hosts in config order
+        """
+
+    def write_report(self, host, name, report):
+        """
+        Called when report name has been generated for host
+        """
+        self.write_record({'host': host, 'name': name, 'report': report})
+
+    def end_host(self, host, error=None):
+        """
+        Called when all reports for host have been generated, or generating them failed with error
+        """
+        if error is not None:
+            self.write_record({'host': host, 'error': error})
+
+    def write_record(self, record):
+        with self._lock:
+            self._write_record(record)
+
+    def _write_record(self, record):
+        """
+        Write record, with self._lock held
+        """
+        self._write(record)
+        if self.flush:
+            self.f.flush()
+            os.fsync(self.f.fileno())
+
+    def _write(self, record):
+        raise NotImplementedError()
+
+    def close(self):
+        self.f.close()
+
+
+class YamlStreamWriter(ReportWriter):
+    def _write(self, record):
+        yaml.dump(record, self.f, Dumper=Dumper, explicit_start=True)
+
+
+class JsonLinesWriter(ReportWriter):
+    def _write(self, record):
+        self.f.write(json.dumps(record, sort_keys=True) + '\n')
+
+
+class YamlListWriter(ReportWriter):
+    """
+    Writes the original single list format, one host at a time, in config order
+
+    Hosts that finish before the ones ahead of them in config order are held
+    back until those have been written, so the list comes out in the same
+    order however many hosts are audited at once. Only the reports of hosts
+    that have not been written yet are kept in memory.
+    """
+    def __init__(self, f, flush=False):
+        super(YamlListWriter, self).__init__(f, flush)
+        self._hosts = {}
+        self._order = []
+        self._finished = {}
+
+    def start(self, hosts):
+        with self._lock:
+            self._order = list(hosts)
+
+    def write_report(self, host, name, report):
+        with self._lock:
+            self._hosts.setdefault(host, []).append({'name': name, 'report': report})
+
+    def end_host(self, host, error=None):
+        with self._lock:
+            host_report = {'host': host, 'reports': self._hosts.pop(host, [])}
+        if error is not None:
+            host_report['error'] = error
+        with self._lock:
+            if host not in self._order:
+                self._write_record(host_report)
+                return
+            self._finished[host] = host_report
+            while self._order and self._order[0] in self._finished:
+                self._write_record(self._finished.pop(self._order.pop(0)))
+
+    def _write(self, host_report):
+        # Dumping a one item list at a time appends to a single top level list
+        yaml.dump([host_report], self.f, Dumper=Dumper)
+
+
+class ReportCollector(ReportWriter):
+    """
+    Collects host reports in memory, in the original format
+    """
+    def __init__(self):
+        super(ReportCollector, self).__init__(None)
+        self.hosts = {}
+
+    def write_report(self, host, name, report):
+        with self._lock:
+            self.hosts.setdefault(host, {'host': host, 'reports': []})['reports'].append({
+                'name': name,
+                'report': report
+            })
+
+    def end_host(self, host, error=None):
+        with self._lock:
+            host_report = self.hosts.setdefault(host, {'host': host, 'reports': []})
+            if error is not None:
+                host_report['error'] = error
+
+    def close(self):
+        pass
+
+
+class CompactWriter(ReportWriter):
+    """
+    Writes every distinct finding once, with the hosts and dbs it was found on
+
+    A model change or a view rollout makes the same diff show up in hundreds
+    of dbs on every host, which the other formats repeat in full every time.
+    Here each distinct value (a diff, or a skeleton of a report) is written
+    once on a line of its own, with an id derived from its content, so the
+    ids are the same from run to run and output of two runs diffs cleanly:
+
+        {"compact": 1}
+        {"id": "<md5 of value>", "value": <value>}  (one per distinct value, by id)
+        {"host": <host>, "name": <report>, "skeleton": <value id>}  (one per report on a host)
+        {"host": <host>, "error": <error>}  (one per failed host)
+        {"name": <report>, "table": <table>, "value": <value id>, "at": {<host>: [<db>, ...]}}
+                                                    (one per distinct finding, by report, table and value)
+
+    See labsdb.auditor.findings for how reports are split into findings.
+    """
+    def __init__(self, f, flush=False):
+        super(CompactWriter, self).__init__(f, flush)
+        self._values = {}  # id -> value
+        self._records = []
+        self._findings = {}  # (report, table, value id) -> dict of host -> list of dbs
+
+    def _intern(self, value):
+        data = json.dumps(value, sort_keys=True)
+        value_id = hashlib.md5(data.encode('utf-8')).hexdigest()
+        self._values[value_id] = data
+        return value_id
+
+    def write_report(self, host, name, report):
+        with self._lock:
+            self._records.append({'host': host, 'name': name, 'skeleton': self._intern(skeleton(name, report))})
+            for db, table, value in iter_findings(name, report):
+                at = self._findings.setdefault((name, table, self._intern(value)), {})
+                at.setdefault(host, []).append(db)
+
+    def end_host(self, host, error=None):
+        with self._lock:
+            if error is not None:
+                self._records.append({'host': host, 'error': error})
+            if self.flush:
+                self._dump()
+
+    def _dump(self):
+        self.f.seek(0)
+        self.f.truncate()
+        self.f.write(json.dumps({'compact': COMPACT_VERSION}) + '\n')
+        for value_id in sorted(self._values):
+            self.f.write('{"id": "%s", "value": %s}\n' % (value_id, self._values[value_id]))
+        for record in self._records:
+            self.f.write(json.dumps(record, sort_keys=True) + '\n')
+        for key in sorted(self._findings, key=lambda k: (k[0], k[1] or '', k[2])):
+            at = OrderedDict((host, sorted(dbs)) for host, dbs in sorted(self._findings[key].items()))
+            self.f.write(json.dumps(OrderedDict([('name', key[0]), ('table', key[1]), ('value', key[2]),
+                                                 ('at', at)])) + '\n')
+        if self.flush:
+            self.f.flush()
+            os.fsync(self.f.fileno())
+
+    def close(self):
+        with self._lock:
+            self._dump()
+        self.f.close()
+
+
+WRITERS = {
+    'yaml': YamlListWriter,
+    'yaml-stream': YamlStreamWriter,
+    'jsonl': JsonLinesWriter,
+    'compact': CompactWriter,
+}
+
+
+def open_writer(path, output_format, flush=False):
+    """
+    Open a writer of given format, that writes to path
+    """
+    return WRITERS[output_format](open(path, 'w'), flush)
+
+
+def read_records(path):
+    """
+    Yield records from a report output file written in any of the formats
+
+    jsonl and yaml-stream files are read a record at a time. Files in the
+    yaml format are split into records for each host, and compact files are
+    expanded back into records, so that all formats can be handled the same way.
+    """
+    with open(path) as f:
+        first_line = f.readline()
+        f.seek(0)
+        if first_line.startswith('{"compact"'):
+            for record in _read_compact(f):
+                yield record
+            return
+        if first_line.startswith('{'):
+            for line in f:
+                if line.strip():
+                    yield json_loads(line)
+            return
+        for doc in yaml.load_all(f, Loader=SafeLoader):
+            if isinstance(doc, list):
+                for host_report in doc:
+                    for report in host_report.get('reports', []):
+                        yield {'host': host_report['host'], 'name': report['name'], 'report': report['report']}
+                    if 'error' in host_report:
+                        yield {'host': host_report['host'], 'error': host_report['error']}
+            elif doc is not None:
+                yield doc
+
+
+def _read_compact(f):
+    """
+    Yield records from a file written by CompactWriter, in the order they were written
+    """
+    version = json_loads(f.readline())['compact']
+    if version != COMPACT_VERSION:
+        raise ValueError('Unsupported compact report version %s' % version)
+    values = {}
+    records = []
+    findings = {}  # (host, report) -> list of (db, table, value)
+    for line in f:
+        if not line.strip():
+            continue
+        record = json_loads(line)
+        if 'at' in record:
+            value = values[record['value']]
+            for host, dbs in record['at'].items():
+                host_findings = findings.setdefault((host, record['name']), [])
+                host_findings.extend((db, record['table'], value) for db in dbs)
+        elif 'id' in record:
+            values[record['id']] = record['value']
+        else:
+            records.append(record)
+    for record in records:
+        if 'error' in record:
+            yield record
+        else:
+            yield {
+                'host': record['host'],
+                'name': record['name'],
+                'report': build_report(record['name'], values[record['skeleton']],
+                                       findings.get((record['host'], record['name']), []))
+            }
@@ -0,0 +1,28 @@
+# Copyright 2015 Yuvi Panda <yuvipanda@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from labsdb.auditor.reports.databases import databases_report
+from labsdb.auditor.reports.rows import sanitized_rows_report
+from labsdb.auditor.reports.tables import extra_tables_report
+from labsdb.auditor.reports.viewdiffs import views_schema_diff_report
+
+
+def register_reports(runner, config):
+    """
+    Register all the reports that config asks for with a ReportRunner
+    """
+    runner.register_report(databases_report)
+    runner.register_report(extra_tables_report)
+    runner.register_report(views_schema_diff_report)
+    if 'row-checks' in config:
+        runner.register_report(sanitized_rows_report)
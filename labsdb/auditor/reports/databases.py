@@ -13,10 +13,8 @@
 # limitations under the License.
 import re
 
-from labsdb.auditor.utils import get_databases
 
-
-def databases_report(config, model, conn):
+def databases_report(config, model, host):
     """
     Diff of what databases exist on labsdb and what should
 
@@ -26,11 +24,13 @@ def databases_report(config, model, conn):
         - missing_private_dbs -> Fully Replicated DBs that should be in labsdb but aren't
         - missing_public_dbs -> Publicly Viewable DBs that should be in labsdb but aren't
     """
-    server_dbs = get_databases(conn)
+    server_dbs = host.catalog.databases
     # Both the private databases and the _p variants that are accessible to public
-    whitelisted_dbs = model.public_dbs + model.private_dbs
+    whitelisted_dbs = set(model.public_dbs + model.private_dbs)
     ignore_re = re.compile(config['user-dbname-regex'])
-    extra_dbs = [db for db in server_dbs if db not in whitelisted_dbs and not ignore_re.match(db)]
+    # In a sharded run, each extra db is reported only by the run of its shard
+    extra_dbs = [db for db in sorted(server_dbs)
+                 if db not in whitelisted_dbs and not ignore_re.match(db) and model.in_shard(db)]
     missing_public_dbs = [db for db in model.public_dbs if db not in server_dbs]
     missing_private_dbs = [db for db in model.private_dbs if db not in server_dbs]
     return {
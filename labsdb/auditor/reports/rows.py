@@ -0,0 +1,223 @@
+# Copyright 2015 Yuvi Panda <yuvipanda@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Verification of the rows that come out of the public views
+
+The view reports only check that views are defined the way the model says.
+This checks the data itself: for every conditionally nulled column of a
+view, that no row of the view has a value in it where its null_if condition
+holds for the row in the underlying table.
+
+Tables are scanned in chunks of config['row-checks']['chunk-size'] rows,
+by range of their (single column, integer) primary key, so that no query
+touches more than a chunk of rows at a time. Settings, all optional:
+
+    row-checks:
+      chunk-size: 10000  # Rows per chunk
+      chunk-sleep: 0.1  # Seconds to wait between chunks, to go easy on the replicas
+      time-budget: 300  # Seconds to spend per table, before giving up on the rest of it
+      sample-chunks: 0  # Check only this many randomly placed chunks per table, 0 to check all
+      tables: [archive]  # Only check these views, default all with conditionally nulled columns
+"""
+import functools
+import logging
+import random
+import time
+from collections import OrderedDict
+
+INTEGER_TYPES = frozenset(['tinyint', 'smallint', 'mediumint', 'int', 'bigint'])
+
+
+def _checked_columns(table):
+    """
+    Get OrderedDict of null_if condition -> names of columns nulled by it, for table
+    """
+    conditions = OrderedDict()
+    for name in sorted(table.columns):
+        column = table.columns[name]
+        if not column.whitelisted and column.null_if:
+            conditions.setdefault(column.null_if, []).append(name)
+    return conditions
+
+
+def _primary_keys(conn, db):
+    """
+    Get dict of table name -> (primary key column, data type), for tables in db with a single column primary key
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT TABLE_NAME, COLUMN_NAME, DATA_TYPE FROM information_schema.COLUMNS "
+                "WHERE TABLE_SCHEMA = %s AND COLUMN_KEY = 'PRI'", (db, ))
+    keys = {}
+    for table_name, column_name, data_type in cur.fetchall():
+        keys.setdefault(table_name, []).append((column_name, data_type))
+    cur.close()
+    return dict((name, columns[0]) for name, columns in keys.items() if len(columns) == 1)
+
+
+def _range_condition(pk, lo, hi):
+    """
+    Get (SQL condition, args) selecting pk in the range (lo, hi], where None is unbounded
+    """
+    conditions = []
+    args = []
+    if lo is not None:
+        conditions.append('`%s` > %%s' % pk)
+        args.append(lo)
+    if hi is not None:
+        conditions.append('`%s` <= %%s' % pk)
+        args.append(hi)
+    return ' AND '.join(conditions) or '1', args
+
+
+def _chunk_end(cur, private_table, pk, lo, chunk_size):
+    """
+    Get the primary key of the last row of the chunk starting after lo, None if it is the last chunk
+    """
+    condition, args = _range_condition(pk, lo, None)
+    cur.execute('SELECT `%s` FROM %s WHERE %s ORDER BY `%s` LIMIT 1 OFFSET %s'
+                % (pk, private_table, condition, pk, chunk_size - 1), args)
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def _check_chunk(cur, view, private_table, pk, conditions, lo, hi):
+    """
+    Count rows of view in the chunk (lo, hi] that have a value where it should be nulled
+
+    :return: dict of column name -> number of such rows, for columns that have any
+    """
+    violations = {}
+    condition, args = _range_condition(pk, lo, hi)
+    for null_if, columns in conditions.items():
+        # Inside the subquery, unqualified names resolve to the underlying table first
+        cur.execute('SELECT %s FROM %s WHERE %s AND `%s` IN (SELECT `%s` FROM %s WHERE %s AND (%s))'
+                    % (', '.join('SUM(`%s` IS NOT NULL)' % c for c in columns), view, condition,
+                       pk, pk, private_table, condition, null_if), args + args)
+        for column, count in zip(columns, cur.fetchone()):
+            if count:
+                violations[column] = int(count)
+    return violations
+
+
+def _check_table(settings, conn, db, table, pk):
+    """
+    Check the rows of view table in public db db
+
+    :return: (dict of column name -> rows with values where they should be nulled,
+              primary key up to which the table was checked if the time budget ran out, else None)
+    """
+    private_table = '`%s`.`%s`' % (db[:-2], table.table_name)
+    view = '`%s`.`%s`' % (db, table.name)
+    conditions = _checked_columns(table)
+    chunk_size = settings.get('chunk-size', 10000)
+    chunk_sleep = settings.get('chunk-sleep', 0.1)
+    time_budget = settings.get('time-budget', 300)
+    sample_chunks = settings.get('sample-chunks', 0)
+
+    cur = conn.cursor()
+    if sample_chunks:
+        cur.execute('SELECT MIN(`%s`), MAX(`%s`) FROM %s' % (pk, pk, private_table))
+        min_pk, max_pk = cur.fetchone()
+        if min_pk is None:
+            starts = []
+        else:
+            starts = sorted(random.randint(min_pk - 1, max_pk) for i in range(sample_chunks))
+    else:
+        starts = [None]
+
+    violations = {}
+    start_time = time.time()
+    hi = None
+    for i, lo in enumerate(starts):
+        if i > 0:
+            if hi is None:
+                break  # Last sampled chunk reached the end of the table
+            # Sampled chunks do not overlap, so that no row is counted twice
+            lo = max(lo, hi)
+        while True:
+            hi = _chunk_end(cur, private_table, pk, lo, chunk_size)
+            for column, count in _check_chunk(cur, view, private_table, pk, conditions, lo, hi).items():
+                violations[column] = violations.get(column, 0) + count
+            time.sleep(chunk_sleep)
+            if hi is None:
+                break
+            if time.time() - start_time > time_budget:
+                cur.close()
+                return violations, hi
+            if sample_chunks:
+                break
+            lo = hi
+    cur.close()
+    return violations, None
+
+
+def _check_db(model, settings, catalog, checkpoint, conn, db):
+    """
+    Check the rows of all views with conditionally nulled columns in public db db
+
+    :return: dict with 'violations' (view -> column -> rows), 'incomplete' (view -> primary key
+             checked up to) and 'skipped' (view -> reason), each only if not empty
+    """
+    unit = checkpoint.get(db) if checkpoint is not None else None
+    if unit is not None:
+        return unit
+    private_db = db[:-2]
+    keys = _primary_keys(conn, private_db)
+    result = {}
+    for name in settings.get('tables') or sorted(model.tables):
+        table = model.tables.get(name)
+        if table is None or not _checked_columns(table) or name not in catalog.get_views(db):
+            continue
+        if table.table_name not in catalog.get_tables(private_db):
+            continue  # Reported by tables.py
+        pk, data_type = keys.get(table.table_name, (None, None))
+        if pk is None or data_type not in INTEGER_TYPES:
+            result.setdefault('skipped', {})[name] = 'No single column integer primary key'
+            continue
+        if pk not in table.columns or not table.columns[pk].whitelisted:
+            result.setdefault('skipped', {})[name] = 'Primary key %s not exposed in view' % pk
+            continue
+        logging.debug('Checking rows of %s.%s', db, name)
+        violations, checked_up_to = _check_table(settings, conn, db, table, pk)
+        if violations:
+            result.setdefault('violations', {})[name] = violations
+        if checked_up_to is not None:
+            logging.warning('Time budget for checking rows of %s.%s ran out at %s = %s', db, name, pk, checked_up_to)
+            result.setdefault('incomplete', {})[name] = checked_up_to
+    if checkpoint is not None:
+        checkpoint.record(db, result)
+    return result
+
+
+def sanitized_rows_report(config, model, host):
+    """
+    Rows visible in public views that have values in columns that should be nulled for them
+
+    Includes, for each public db with anything to report:
+
+        - violations -> view -> column -> number of rows with a value where the column's null_if holds
+        - incomplete -> view -> primary key up to which it was checked, before the time budget ran out
+        - skipped -> view -> why its rows could not be checked
+    """
+    settings = config.get('row-checks') or {}
+    dbs = [db for db in model.public_dbs if db in host.catalog.databases]
+    check_db = functools.partial(_check_db, model, settings, host.catalog, host.checkpoint)
+    report = {}
+    for db, result in zip(dbs, host.map(check_db, dbs)):
+        if result:
+            report[db] = result
+        if result.get('violations'):
+            logging.error('Rows with values that should be nulled found in DB %s - in %s tables',
+                          db, len(result['violations']))
+    return report
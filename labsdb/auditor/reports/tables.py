@@ -13,24 +13,17 @@
 # limitations under the License.
 import logging
 
-import MySQLdb
-from labsdb.auditor.utils import get_tables, diff_iters
+from labsdb.auditor.utils import diff_iters
 
 
-def _get_extra_tables(model, conn, dbs):
+def _get_extra_tables(model, catalog, dbs):
     extra_tables_dbs = {}  # K:V :: tablename::list<dbname>
     for db in dbs:
         logging.debug('Finding extra tables on %s', db)
-        try:
-            extra_tables, _ = diff_iters(get_tables(conn, db), model.tables)
-        except MySQLdb.OperationalError as e:
-            # Ignore missing database errors (cod 1049).
-            # Not using MySQLdb.constants.ER because it is stupid and needs to be explicitly imported to use.
-            if e[0] == 1049:
-                logging.error('Skipping extra tables check on %s - db not found', db)
-                continue  # We have other reports taking care of unknown dbs
-            else:
-                raise
+        if db not in catalog.databases:
+            logging.error('Skipping extra tables check on %s - db not found', db)
+            continue  # We have other reports taking care of unknown dbs
+        extra_tables, _ = diff_iters(catalog.get_tables(db), model.tables)
         if extra_tables:
             for tablename in extra_tables:
                 if tablename in extra_tables_dbs:
@@ -40,8 +33,8 @@ def _get_extra_tables(model, conn, dbs):
     return extra_tables_dbs
 
 
-def extra_tables_report(config, model, conn):
+def extra_tables_report(config, model, host):
     return {
-        'extra_tables_public_dbs': _get_extra_tables(model, conn, model.public_dbs),
-        'extra_tables_private_dbs': _get_extra_tables(model, conn, model.private_dbs)
+        'extra_tables_public_dbs': _get_extra_tables(model, host.catalog, model.public_dbs),
+        'extra_tables_private_dbs': _get_extra_tables(model, host.catalog, model.private_dbs)
     }
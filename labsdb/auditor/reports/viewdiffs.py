@@ -11,13 +11,21 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-import copy
+import functools
 import logging
+import multiprocessing
+import threading
+
+try:
+    import Queue
+except ImportError:
+    import queue as Queue
 
 import re
-from pyparsing import OneOrMore, Optional, Word, SkipTo, StringEnd, alphanums
-from auditor.models import Column, Table
-from labsdb.auditor.utils import get_tables, diff_iters, common_iters
+import MySQLdb.cursors
+from labsdb.auditor.metrics import REGISTRY, timed
+from labsdb.auditor.utils import diff_iters, common_iters
+from labsdb.auditor.viewsql import PARSERS, parse_view_sql, render_view_sql
 
 
 def _diff(expected, actual, fields):
@@ -37,7 +45,12 @@ def diff_columns(expected, actual):
     return _diff(expected, actual, ('name', 'whitelisted', 'null_if'))
 
 
+@timed('diff_tables')
 def diff_tables(expected, actual):
+    # Nearly every view matches the model exactly, and tables with the same
+    # digest have no differences, so skip the detailed diff for those
+    if expected.digest == actual.digest:
+        return None
     table_diff = _diff(expected, actual, ('name', 'include_row_if', 'table_name'))
     missing_cols, extra_cols = diff_iters(expected.columns, actual.columns)
     common_columns = common_iters(actual.columns, expected.columns)
@@ -60,87 +73,647 @@ def diff_tables(expected, actual):
 
 
 EXTRACT_VIEWDEF_RE = re.compile(r"DEFINER VIEW `([^`]+)` AS (.*)")
+# Matches quoted qualifiers (`dbname`. or `tablename`.), which is how MySQL always shows them
+QUOTED_QUALIFIER_RE = re.compile(r"`([^`]*)`\.")
+# Matches qualifiers (dbname. or tablename.) in front of identifiers, skipping string literals
+QUALIFIER_RE = re.compile(r"('(?:[^'\\]|\\.)*')|\b(\w+)\.(?=[A-Za-z_])")
 
 
-def _cleanup_viewdefiner(full_sql, db, table):
+def _cleanup_viewdefiner(full_sql, db, table_name):
     """
     Clean up the view definer SQL to make it easier to parse
 
     Picks out only the SELECT statement from the definer.
-    Also reduces all references of form dbname.tablename.column to just column
+    Also reduces all references of form dbname.tablename.column to just column,
+    where dbname is the private db of db and tablename is table_name.
     Removes backticks as well
     """
     definer_sql = EXTRACT_VIEWDEF_RE.search(full_sql).groups()[1]
-    private_db_name = db.replace('_p', '')
-    sql = definer_sql.replace('`', '') \
-        .replace(private_db_name + '.', '') \
-        .replace(table + '.', '')
+    return _cleanup_view_definition(definer_sql, db, table_name)
+
+
+def _cleanup_view_definition(definer_sql, db, table_name):
+    """
+    Clean up the SELECT statement of a view definer, as found in
+    information_schema.VIEWS.VIEW_DEFINITION
+
+    See _cleanup_viewdefiner for what is cleaned up. Since only the qualifiers
+    naming the view's own private db and table are removed, the result is the
+    same for a view in every db that is defined the same way. Any other
+    qualifier (eg. officewiki.archive in a view of enwiki_p) is kept, and
+    reported by _diff_definer.
 
+    :param db: Public db the view is in
+    :param table_name: Name of the table the view is modelled to select from
+    """
+    own = (db[:-2] if db.endswith('_p') else db, table_name)
+    sql = QUOTED_QUALIFIER_RE.sub(lambda m: '' if m.group(1) in own else m.group(0), definer_sql).replace('`', '')
+    if '.' in sql:
+        # Unquoted qualifiers, or just a . in a string literal
+        sql = QUALIFIER_RE.sub(lambda m: m.group(1) or ('' if m.group(2) in own else m.group(0)), sql)
     return sql
 
-# We have to parse a specific subset of SQL, that is used to define views
-# The Grammar is:
-#
-# sql = "SELECT" { column-defintions } "FROM" wikiname.tablename [ "WHERE" cond ]
-# column-definition = column-name "AS" column-name
-#                     | "NULL" "AS" column-name
-#                     | "IF(" cond ", NULL, " column-name ")" "AS" column-name
-#
-# Where cond is a valid SQL relational expression, column-name, wikiname, tablename are strings
 
-identifier = alphanums + "_"
-if_definition = "if(" + SkipTo(",")("null_if") + "," + Word(identifier) + "," + Word(identifier) + ")"
-column_definition = (if_definition ^ Word(identifier)('expression')) + "AS" + Word(identifier)("name") + Optional(",")
-sql_definition = "select" + OneOrMore(column_definition)("columns") + \
-                 "from" + Word(identifier)("tablename") + \
-                 Optional("where" + SkipTo(StringEnd())("include_row_if")) + StringEnd()
+def _foreign_qualifiers(sql):
+    """
+    Get the sorted qualifiers left in cleaned up definer sql, which all name another db or table
+    """
+    if '.' not in sql:
+        return []
+    return sorted(set(m.group(2) for m in QUALIFIER_RE.finditer(sql) if m.group(2)))
 
 
-# Caches cleaned definer sql -> table instances
-# Since a lot of definers are the same, this memoization should speed things up
+def _parse_definer(parse, sql, viewname):
+    """
+    Parse cleaned up definer sql into a FrozenTable, ignoring foreign qualifiers
+
+    The parsers only know about unqualified names. The qualifiers themselves
+    are reported by _diff_definer.
+    """
+    if _foreign_qualifiers(sql):
+        sql = QUALIFIER_RE.sub(lambda m: m.group(1) or '', sql)
+    return parse(sql, viewname).freeze()
+
+
+# Caches (viewname, cleaned definer sql) -> table instances
+# Since the cleaned definers are the same across dbs and hosts, this memoization
+# means only a handful of distinct definers per view are ever parsed. Tables in
+# here are FrozenTables, shared by everyone that gets them. Definers selecting
+# from another db or table keep their foreign qualifiers in the key, so they
+# never share an entry with the definer of the view's own table.
 cache = {}
 
 
-def _table_from_definer(sql, viewname):
+@timed('_table_from_definer')
+def _table_from_definer(sql, viewname, parse=parse_view_sql):
     """
     Build a Table object given a cleaned up SQL statement that defines the view
-    """
-    if sql in cache:
-        return copy.deepcopy(cache[sql])
-    res = sql_definition.parseString(sql)
-    table = Table(viewname, {}, res.include_row_if if res.include_row_if else None, res.tablename)
-    for tokens, start, end in column_definition.scanString(sql):
-        table.add_column(Column(tokens.name,
-                                whitelisted=tokens.null_if == '' and tokens.expression != 'NULL',
-                                null_if=tokens.null_if if tokens.null_if else None))
 
-    cache[sql] = table
+    The returned FrozenTable is shared with other callers.
+
+    :param parse: One of labsdb.auditor.viewsql.PARSERS
+    """
+    key = (viewname, sql)
+    table = cache.get(key)
+    if table is None:
+        table = _parse_definer(parse, sql, viewname)
+        cache[key] = table
     return table
 
 
-def views_schema_diff_report(config, model, conn):
+def _iter_view_definitions(conn, dbs, definitions=True):
     """
-    Diff between schema of views in the public db and how they should be
+    Yield (db, viewname, definer_hash, definer_sql) for every view in the given dbs
+
+    Streams the definers from information_schema.VIEWS in a single query,
+    instead of issuing one query per view. definer_hash is the MD5 of the
+    definer, computed by the server.
+
+    :param definitions: False to only fetch the hashes, and yield (db, viewname, definer_hash)
+    """
+    columns = 'TABLE_SCHEMA, TABLE_NAME, MD5(VIEW_DEFINITION)'
+    if definitions:
+        columns += ', VIEW_DEFINITION'
+    cur = conn.cursor(MySQLdb.cursors.SSCursor)
+    cur.execute('SELECT %s FROM information_schema.VIEWS WHERE TABLE_SCHEMA IN (%s)'
+                % (columns, ', '.join(['%s'] * len(dbs))), dbs)
+    for row in cur:
+        yield row
+    cur.close()
+
+
+# Table digest -> set of cleaned up definer SQL known to define a view exactly as the table says
+# Starts out with the rendering of the table by render_view_sql, and learns every other
+# rendering (eg. with columns in a different order) that a server turns out to use.
+clean_definers = {}
+
+
+def _clean_definers_for(table):
+    """
+    Get the set of cleaned up definer SQL that define a view exactly as table says
+    """
+    definers = clean_definers.get(table.digest)
+    if definers is None:
+        definers = set()
+        sql = render_view_sql(table)
+        try:
+            # Only trust the rendering if it parses back into the same table
+            if parse_view_sql(sql, table.name).freeze().digest == table.digest:
+                definers.add(sql)
+        except ValueError:
+            pass
+        clean_definers[table.digest] = definers
+    return definers
+
+
+def _lookup_definer(table, name, sql):
+    """
+    Look up cleaned up definer sql of view name, without parsing it
+
+    :return: (True, None) if sql is known to define the view exactly as table says,
+             otherwise (False, FrozenTable for sql from the parse cache, None if it is not parsed yet)
+    """
+    if sql in _clean_definers_for(table):
+        REGISTRY.inc('labsdb_auditor_clean_definer_total', result='match')
+        return True, None
+    REGISTRY.inc('labsdb_auditor_clean_definer_total', result='mismatch')
+    parsed = cache.get((name, sql))
+    REGISTRY.inc('labsdb_auditor_parse_cache_total', result='hit' if parsed is not None else 'miss')
+    return False, parsed
+
+
+def _diff_definer(table, sql, parsed):
+    """
+    Diff table against parsed, the FrozenTable parsed from definer sql, remembering sql if they match
+
+    Qualifiers naming another db or table than the view's own are reported as
+    a 'qualifiers' mismatch, since the view then reads data the model does not
+    say it should.
+    """
+    diff = diff_tables(table, parsed)
+    foreign = _foreign_qualifiers(sql)
+    if foreign:
+        diff = dict(diff or {}, qualifiers={'expected': [], 'found': foreign})
+    if diff is None:
+        _clean_definers_for(table).add(sql)
+    return diff
+
+
+def _diff_view(table, name, sql, parse):
+    """
+    Diff the model of a view against the cleaned up SQL defining it on the server
+
+    Definers known to match the model exactly are recognized with a single
+    lookup, and only others are parsed and diffed.
+    """
+    clean, parsed = _lookup_definer(table, name, sql)
+    if clean:
+        return None
+    return _diff_definer(table, sql, parsed or _table_from_definer(sql, name, parse))
+
+
+def _log_db_report(db, report_db):
+    if report_db:
+        logging.info("Differences found in DB %s - %s tables with differences", db, len(report_db))
+    else:
+        logging.info("No differences found in DB %s", db)
+
+
+def _iter_views(model, last_views, conn, dbs):
+    """
+    Yield (db, name, view) for every modelled view in dbs, fetching their definers in one query
+
+    view is the entry for it from last_views, if its definer and model table
+    have not changed since and it can be reused as is. Otherwise it is a new
+    {'definer', 'model', 'sql'} dict, where 'sql' is the cleaned up definer
+    that still has to be parsed and diffed.
+
+    :param last_views: 'views' of the host's Snapshot from the last run. Only views not
+                       reusable from there are fetched. None to fetch everything.
+    """
+    pending = None  # (db, view) pairs that need to be diffed, None for all of them
+    fetch_dbs = dbs
+    if last_views is not None:
+        pending = set()
+        reused = 0
+        for db, name, definer_hash in _iter_view_definitions(conn, dbs, definitions=False):
+            if name not in model.tables:
+                continue
+            last = last_views.get(db, {}).get(name)
+            if last and last['definer'] == definer_hash and last['model'] == model.tables[name].digest:
+                reused += 1
+                yield db, name, last
+            else:
+                pending.add((db, name))
+        fetch_dbs = sorted(set(db for db, name in pending))
+        logging.debug('Reused %s unchanged views, %s views changed', reused, len(pending))
+
+    if fetch_dbs:
+        for db, name, definer_hash, definer_sql in _iter_view_definitions(conn, fetch_dbs):
+            # Missing / extra tables are reported from tables.py
+            if name not in model.tables or (pending is not None and (db, name) not in pending):
+                continue
+            yield db, name, {
+                'definer': definer_hash,
+                'model': model.tables[name].digest,
+                'sql': _cleanup_view_definition(definer_sql, db, model.tables[name].table_name)
+            }
+
+
+def _record_view(report, views, db, name, view):
+    views.setdefault(db, {})[name] = view
+    if view['diff']:
+        report.setdefault(db, {})[name] = view['diff']
+
+
+def _diff_views_bulk(model, parse, last_views, conn, dbs):
+    """
+    Diff all modelled views in dbs, fetching their definers in one query
+
+    :param last_views: See _iter_views
+    :return: (dict of db -> report for that db, for dbs with differences,
+              'views' snapshot for dbs)
     """
     report = {}
+    views = {}
+    for db, name, view in _iter_views(model, last_views, conn, dbs):
+        if 'sql' in view:
+            sql = view.pop('sql')
+            view['diff'] = _diff_view(model.tables[name], name, sql, parse)
+        _record_view(report, views, db, name, view)
+    return report, views
+
+
+def _parse_definers(parser_name, keys):
+    """
+    Parse a chunk of (viewname, cleaned definer sql) in a worker process
+
+    :return: List of FrozenTables, in the same order as keys
+    """
+    parse = PARSERS[parser_name]
+    return [_parse_definer(parse, sql, name) for name, sql in keys]
+
+
+class _FetchStopped(Exception):
+    pass
+
+
+def _fetch_views(model, last_views, put, stop, conn, dbs):
+    """
+    Fetch stage of _diff_views_pipelined, put every (db, name, view) from _iter_views
+
+    Raises _FetchStopped once stop is set, so that host.map does not go on
+    to query the rest of the batches.
+    """
+    if stop.is_set():
+        raise _FetchStopped()
+    for item in _iter_views(model, last_views, conn, dbs):
+        if stop.is_set():
+            raise _FetchStopped()
+        put(item)
+
+
+_FETCH_DONE = object()
+
+
+def _diff_views_pipelined(model, parser_name, last_views, host, batches, workers, chunk_size, queue_size):
+    """
+    Diff all modelled views in batches of dbs, overlapping fetching with parsing
+
+    Definers are fetched with host.map (so up to db-parallelism batches at a
+    time) into a bounded queue, that this thread takes them from. Definers not
+    in the parse cache are deduplicated and parsed chunk_size at a time by a
+    pool of worker processes, so parsing is not limited to a single core, and
+    views are diffed as their parsed definers come back. The pool is
+    host.parse_pool, shared by all hosts, or a pool of worker processes
+    just for this call if the host has none.
+
+    :return: Same as _diff_views_bulk, for all the dbs in batches
+    """
+    report = {}
+    views = {}
+    fetched = Queue.Queue(queue_size)
+    stop = threading.Event()
+
+    def fetch():
+        try:
+            host.map(functools.partial(_fetch_views, model, last_views, fetched.put, stop), batches)
+            fetched.put(_FETCH_DONE)
+        except Exception as e:
+            fetched.put(e)
+
+    def diff(db, name, view, sql, parsed):
+        view['diff'] = _diff_definer(model.tables[name], sql, parsed)
+        _record_view(report, views, db, name, view)
+
+    def resolve(keys, tables):
+        for key, parsed in zip(keys, tables):
+            cache[key] = parsed
+            for db, name, view in waiting.pop(key):
+                diff(db, name, view, key[1], parsed)
+
+    waiting = {}  # (viewname, sql) being parsed -> list of (db, name, view) waiting for it
+    chunk = []  # (viewname, sql) not yet sent to the workers
+    parsing = []  # (keys, AsyncResult) sent to the workers
+
+    fetcher = threading.Thread(target=fetch, name='fetch-views-%s' % host.name)
+    fetcher.daemon = True
+    own_pool = host.parse_pool is None
+    pool = multiprocessing.Pool(workers) if own_pool else host.parse_pool
+    fetcher.start()
+    try:
+        while True:
+            item = fetched.get()
+            if item is _FETCH_DONE:
+                break
+            if isinstance(item, Exception):
+                raise item
+            db, name, view = item
+            if 'sql' not in view:
+                _record_view(report, views, db, name, view)
+                continue
+            key = (name, view.pop('sql'))
+            clean, parsed = _lookup_definer(model.tables[name], name, key[1])
+            if clean:
+                view['diff'] = None
+                _record_view(report, views, db, name, view)
+            elif parsed is not None:
+                diff(db, name, view, key[1], parsed)
+            elif key in waiting:
+                waiting[key].append((db, name, view))
+            else:
+                waiting[key] = [(db, name, view)]
+                chunk.append(key)
+                if len(chunk) >= chunk_size:
+                    parsing.append((chunk, pool.apply_async(_parse_definers, (parser_name, chunk))))
+                    chunk = []
+            while parsing and parsing[0][1].ready():
+                keys, result = parsing.pop(0)
+                resolve(keys, result.get())
+        if chunk:
+            parsing.append((chunk, pool.apply_async(_parse_definers, (parser_name, chunk))))
+        for keys, result in parsing:
+            resolve(keys, result.get())
+    finally:
+        if own_pool:
+            pool.terminate()
+        # Stop the fetcher if we stopped taking from the queue early, and unblock it so
+        # that it notices, and returns its connections
+        stop.set()
+        while fetcher.is_alive():
+            try:
+                fetched.get(timeout=0.1)
+            except Queue.Empty:
+                pass
+    return report, views
+
+
+def _diff_views_per_view(model, catalog, parse, conn, db):
+    """
+    Diff all modelled views in db, issuing one SHOW CREATE VIEW per view
+
+    :return: report for db
+    """
+    report_db = {}
+    # We want views that are present in this db and in our model
+    # because missing / extra tables are reported from tables.py. Base
+    # tables are reported by _base_table_report
+    table_names = common_iters(catalog.get_views(db), model.tables)
+    cur = conn.cursor()
+    for name in table_names:
+        table = model.tables[name]
+        cur.execute('SHOW CREATE VIEW %s.%s' % (db, name))
+        diff = _diff_view(table, name, _cleanup_viewdefiner(cur.fetchone()[1], db, table.table_name), parse)
+        if diff:
+            report_db[name] = diff
+    cur.close()
+    return report_db
+
+
+def _db_view_digests(conn, dbs):
+    """
+    Get a digest of the names and definers of all views in each of the given dbs, computed by the server
+
+    :return: dict of db -> (number of views, checksum of them), for every db in dbs
+    """
     cur = conn.cursor()
-    for db in model.public_dbs:
-        report_db = {}
-        all_tables = get_tables(conn, db)
-        # We want tables that are present in this db and in our model
-        # because missing / extra tables are reported from tables.py
-        table_names = common_iters(all_tables, model.tables)
-        for name in table_names:
-            table = model.tables[name]
-            cur.execute('SHOW CREATE VIEW %s.%s' % (db, name))
-            sql = _cleanup_viewdefiner(cur.fetchone()[1], db, table.table_name)
-            t = _table_from_definer(sql, name)
-            diff = diff_tables(table, t)
-            if diff:
-                report_db[name] = diff
-        if report_db:
-            report[db] = report_db
-            logging.info("Differences found in DB %s - %s tables with differences", db, len(report_db))
+    cur.execute('SELECT TABLE_SCHEMA, COUNT(*), BIT_XOR(CAST(CONV(SUBSTRING('
+                "MD5(CONCAT(TABLE_NAME, ':', VIEW_DEFINITION)), 1, 16), 16, 10) AS UNSIGNED)) "
+                'FROM information_schema.VIEWS WHERE TABLE_SCHEMA IN (%s) GROUP BY TABLE_SCHEMA'
+                % ', '.join(['%s'] * len(dbs)), dbs)
+    digests = dict((db, (0, 0)) for db in dbs)
+    for db, count, checksum in cur.fetchall():
+        digests[db] = (int(count), int(checksum))
+    cur.close()
+    return digests
+
+
+class SharedViewDiffs(object):
+    """
+    Views of every db as diffed by any host, for other hosts whose views in that db are the same
+
+    A db is identified by a key of its digest from _db_view_digests, along
+    with the model and parser used, so hosts share the diff of a db only if
+    diffing it on them would have given the same result. Only the latest key
+    for each db is kept.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._dbs = {}  # db -> (key, views snapshot of db or None while a host is diffing it, Event set when diffed)
+
+    def claim(self, db, key):
+        """
+        Get the views of db, or claim diffing it
+
+        :return: ('reuse', views of db) if a host already diffed it,
+                 ('wait', event) if another host is diffing it, and views are available after event is set,
+                 ('diff', event) if the caller has to diff it, and then publish it with event
+        """
+        with self._lock:
+            entry = self._dbs.get(db)
+            if entry is not None and entry[0] == key:
+                return ('wait', entry[2]) if entry[1] is None else ('reuse', entry[1])
+            event = threading.Event()
+            self._dbs[db] = (key, None, event)
+            return 'diff', event
+
+    def publish(self, db, key, event, views):
+        """
+        Publish views of db that were claimed with claim, None if diffing it failed
+        """
+        with self._lock:
+            if self._dbs.get(db) == (key, None, event):
+                if views is None:
+                    del self._dbs[db]
+                else:
+                    self._dbs[db] = (key, views, event)
+        event.set()
+
+    def get(self, db, key):
+        """
+        Get views of db, or None if they are not available (anymore)
+        """
+        with self._lock:
+            entry = self._dbs.get(db)
+        return entry[1] if entry is not None and entry[0] == key else None
+
+    def clear(self):
+        with self._lock:
+            self._dbs.clear()
+
+
+# Shared by all hosts in the process, with dedup-view-diffs
+shared_view_diffs = SharedViewDiffs()
+
+
+def clear_caches():
+    """
+    Clear the parse cache, clean definers and shared view diffs, eg. when the model changes
+
+    Not safe to call while reports are running.
+    """
+    cache.clear()
+    clean_definers.clear()
+    shared_view_diffs.clear()
+
+
+def _diff_views(config, model, host, dbs, last_views):
+    """
+    Diff all modelled views in dbs in bulk, with the engine selected in config
+
+    :return: Same as _diff_views_bulk
+    """
+    batch_size = config.get('view-fetch-batch-size', 100)
+    batches = [dbs[i:i + batch_size] for i in range(0, len(dbs), batch_size)]
+    parser_name = config.get('view-definer-parser', 'fast')
+    workers = config.get('view-parse-workers', 0)
+    if workers > 0:
+        return _diff_views_pipelined(model, parser_name, last_views, host, batches, workers,
+                                     config.get('view-parse-batch-size', 50), config.get('view-queue-size', 1000))
+    report = {}
+    views = {}
+    for batch_report, batch_views in host.map(
+            functools.partial(_diff_views_bulk, model, PARSERS[parser_name], last_views), batches):
+        report.update(batch_report)
+        views.update(batch_views)
+    return report, views
+
+
+def _diff_views_shared(config, model, host, dbs, last_views):
+    """
+    Diff all modelled views in dbs in bulk, sharing diffs of dbs with other hosts through shared_view_diffs
+
+    Dbs are diffed only if no other host has diffed (or is diffing) the same
+    views, otherwise the results of that host are used.
+
+    :return: Same as _diff_views_bulk
+    """
+    batch_size = config.get('view-fetch-batch-size', 100)
+    digests = {}
+    for batch_digests in host.map(_db_view_digests, [dbs[i:i + batch_size] for i in range(0, len(dbs), batch_size)]):
+        digests.update(batch_digests)
+    model_digest = model.digest
+    parser_name = config.get('view-definer-parser', 'fast')
+    keys = dict((db, digests[db] + (model_digest, parser_name)) for db in dbs)
+
+    views = {}
+    claimed = {}  # db -> event, for dbs this host has to diff
+    waiting = {}  # db -> event, for dbs other hosts are diffing
+    for db in dbs:
+        state, value = shared_view_diffs.claim(db, keys[db])
+        if state == 'reuse':
+            views[db] = value
+        elif state == 'wait':
+            waiting[db] = value
         else:
-            logging.info("No differences found in DB %s", db)
+            claimed[db] = value
+    REGISTRY.inc('labsdb_auditor_shared_view_diffs_total', len(views), result='reused')
+    REGISTRY.inc('labsdb_auditor_shared_view_diffs_total', len(waiting), result='waited')
+    REGISTRY.inc('labsdb_auditor_shared_view_diffs_total', len(claimed), result='diffed')
+    logging.debug('Diffing views of %s dbs, reusing %s dbs from other hosts and waiting for %s more',
+                  len(claimed), len(views), len(waiting))
+
+    claimed_views = None
+    try:
+        claimed_views = _diff_views(config, model, host, sorted(claimed), last_views)[1]
+    finally:
+        for db, event in claimed.items():
+            shared_view_diffs.publish(db, keys[db], event,
+                                      claimed_views.get(db, {}) if claimed_views is not None else None)
+    views.update(claimed_views)
+
+    failed = []
+    for db, event in waiting.items():
+        event.wait()
+        db_views = shared_view_diffs.get(db, keys[db])
+        if db_views is None:
+            failed.append(db)
+        else:
+            views[db] = db_views
+    if failed:
+        # Diffing failed on the other host, or it moved on to other views
+        views.update(_diff_views(config, model, host, sorted(failed), last_views)[1])
+
+    return _report_from_views(views), views
+
+
+def _base_table_report(model, catalog, db):
+    """
+    Get report for the base tables in db that are modelled as views
+
+    Neither information_schema.VIEWS nor SHOW CREATE VIEW know about them,
+    so they are found from the catalog instead.
+
+    :return: dict of table name -> {'not_a_view': True}
+    """
+    base_tables = (catalog.get_tables(db) - catalog.get_views(db)) & set(model.tables)
+    return dict((name, {'not_a_view': True}) for name in base_tables)
+
+
+def _report_from_views(views):
+    """
+    Get dict of db -> report for that db, for dbs with differences, from a 'views' snapshot
+    """
+    report = {}
+    for db, db_views in views.items():
+        for name, view in db_views.items():
+            if view['diff']:
+                report.setdefault(db, {})[name] = view['diff']
+    return report
+
+
+def views_schema_diff_report(config, model, host):
+    """
+    Diff between schema of views in the public db and how they should be
+    """
+    report = {}
+    # Only dbs that exist, missing dbs are reported from databases.py
+    dbs = [db for db in model.public_dbs if db in host.catalog.databases]
+    # 'pyparsing' selects the slower reference parser
+    parse = PARSERS[config.get('view-definer-parser', 'fast')]
+    checkpoint = host.checkpoint
+    if config.get('bulk-view-fetch', True):
+        last_views = host.snapshot.get('views') if host.snapshot is not None else None
+        diff_views = _diff_views_shared if config.get('dedup-view-diffs', False) else _diff_views
+        if checkpoint is None:
+            report, views = diff_views(config, model, host, dbs, last_views)
+        else:
+            # Diff a round of dbs (a batch for every connection) at a time, and
+            # checkpoint each db in it after, so that a resumed run can skip them
+            views = {}
+            for db in dbs:
+                unit = checkpoint.get(db)
+                if unit is not None and 'views' in unit:
+                    views[db] = unit['views']
+            todo = [db for db in dbs if db not in views]
+            round_size = config.get('view-fetch-batch-size', 100) * host.parallelism
+            for i in range(0, len(todo), round_size):
+                round_views = diff_views(config, model, host, todo[i:i + round_size], last_views)[1]
+                for db in todo[i:i + round_size]:
+                    views[db] = round_views.get(db, {})
+                    checkpoint.record(db, {'views': views[db]})
+            report = _report_from_views(views)
+        if host.snapshot is not None:
+            host.snapshot['views'] = views
+    else:
+        def diff_db(conn, db):
+            unit = checkpoint.get(db) if checkpoint is not None else None
+            if unit is not None and 'report' in unit:
+                return unit['report']
+            report_db = _diff_views_per_view(model, host.catalog, parse, conn, db)
+            if checkpoint is not None:
+                checkpoint.record(db, {'report': report_db})
+            return report_db
+
+        for db, report_db in zip(dbs, host.map(diff_db, dbs)):
+            if report_db:
+                report[db] = report_db
+    for db in dbs:
+        base_tables = _base_table_report(model, host.catalog, db)
+        if base_tables:
+            report.setdefault(db, {}).update(base_tables)
+        _log_db_report(db, report.get(db))
+    logging.info('Definer parse cache: %s hits, %s misses, %s distinct definers in cache',
+                 REGISTRY.get('labsdb_auditor_parse_cache_total', result='hit'),
+                 REGISTRY.get('labsdb_auditor_parse_cache_total', result='miss'), len(cache))
     return report
@@ -11,20 +11,58 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import functools
 import logging
+import multiprocessing
 import time
+from multiprocessing.pool import ThreadPool
 
-import MySQLdb
+from labsdb.auditor.host import Host
+from labsdb.auditor.metrics import REGISTRY
+from labsdb.auditor.output import ReportCollector
+
+
+def _host_config(config, entry):
+    """
+    Build the config used for a single entry of config['hosts']
+
+    An entry is either a plain 'hostname[:port]' string, or a dict with a
+    'host' key holding that string plus overrides for any top level config
+    key (for example 'bulk-view-fetch: false'), that apply to that host only.
+    """
+    host_config = dict(config)
+    if isinstance(entry, dict):
+        host_config.update(entry)
+    else:
+        host_config['host'] = entry
+    return host_config
 
 
 class ReportRunner(object):
     """
     Runs a set of reports!
     """
-    def __init__(self, config, model):
+    def __init__(self, config, model, snapshot=None, connect=None, checkpoint=None, hosts=None):
+        """
+        :param snapshot: Snapshot of the last run for incremental audits, which is updated as
+                         reports run. None to always audit everything from scratch.
+        :param connect: Function that takes a Host and returns a new connection to it,
+                        defaults to connecting with MySQLdb
+        :param checkpoint: Checkpoint to record completed reports (and parts of them) in, and to
+                           reuse those from when resuming an interrupted run. None to not checkpoint.
+        :param hosts: dict of host name -> Host, to keep Hosts (with their pooled connections) in
+                      across runs. Hosts are reused from it and added to it, and not closed after
+                      a run. None to use new Hosts for every run, and close them after.
+        """
         self.model = model
         self.config = config
+        self.snapshot = snapshot
+        self.connect = connect
+        self.checkpoint = checkpoint
+        self.hosts = hosts
+        self.errors = {}  # host -> error, for hosts that failed
         self._reporters = {}
+        self._parse_pool = None
 
     def register_report(self, func):
         """
@@ -37,31 +75,106 @@ class ReportRunner(object):
         }
         return func
 
-    def run(self):
-        all_reports = []
-        for host in self.config['hosts']:
-            if ':' in host:
-                hostname, port = host.split(':')
-            else:
-                hostname, port = host, 3306
-            logging.info('Generating reports for host %s', host)
-            conn = MySQLdb.connect(host=hostname, port=int(port), read_default_file='~/.my.cnf')
-
-            host_report = {
-                'host': host,
-                'reports': []
-            }
-            for name, reporter in self._reporters.items():
+    def _get_host(self, host_config):
+        """
+        Get the Host for host_config, reusing the one kept from an earlier run if its config has not changed
+        """
+        if self.hosts is None:
+            return Host(host_config, self.connect)
+        host = self.hosts.get(host_config['host'])
+        if host is None or host.config != host_config:
+            if host is not None:
+                host.close()
+            host = self.hosts[host_config['host']] = Host(host_config, self.connect)
+        return host
+
+    def _run_host(self, entry, writer):
+        """
+        Run all reports against a single host, on its own connections
+
+        Each report is passed to writer as soon as it is generated. Errors are
+        logged and passed on to writer.end_host, so that one failing host does
+        not abort the others.
+
+        :return: name of the host
+        """
+        host = self._get_host(_host_config(self.config, entry))
+        host.parse_pool = self._parse_pool
+        error = None
+        logging.info('Generating reports for host %s', host.name)
+        try:
+            try:
                 start_time = time.time()
-                report = reporter['func'](self.config, self.model, conn)
-                host_report['reports'].append({
-                    'name': name,
-                    'report': report
-                })
-                elapsed_time = time.time() - start_time
-                logging.info('Generated %s for %s in %s', name, host, elapsed_time)
-
-            conn.close()
-
-            all_reports.append(host_report)
-        return all_reports
+                host.load_catalog(self.model.private_dbs + self.model.public_dbs)
+                REGISTRY.set('labsdb_auditor_catalog_seconds', time.time() - start_time, host=host.name)
+                logging.info('Loaded catalog for %s in %s', host.name, time.time() - start_time)
+                if self.snapshot is not None:
+                    host.snapshot = self.snapshot.host(host.name)
+                    host.snapshot['databases'] = sorted(host.catalog.databases)
+                    host.snapshot['tables'] = dict((db, sorted(tables))
+                                                   for db, tables in host.catalog.tables.items())
+                for name, reporter in self._reporters.items():
+                    start_time = time.time()
+                    report = self.checkpoint.get(host.name, name) if self.checkpoint is not None else None
+                    if report is not None:
+                        logging.info('Reusing %s for %s from checkpoint', name, host.name)
+                    else:
+                        if self.checkpoint is not None:
+                            host.checkpoint = self.checkpoint.scope(host.name, name)
+                        report = reporter['func'](host.config, self.model, host)
+                        if self.checkpoint is not None:
+                            self.checkpoint.record(host.name, name, None, report)
+                    writer.write_report(host.name, name, report)
+                    elapsed_time = time.time() - start_time
+                    REGISTRY.set('labsdb_auditor_report_seconds', elapsed_time, host=host.name, report=name)
+                    logging.info('Generated %s for %s in %s', name, host.name, elapsed_time)
+            finally:
+                if self.hosts is None:
+                    host.close()
+        except Exception as e:
+            logging.exception('Generating reports for host %s failed', host.name)
+            error = '%s: %s' % (type(e).__name__, e)
+            self.errors[host.name] = error
+        REGISTRY.set('labsdb_auditor_host_failed', 1 if error else 0, host=host.name)
+        writer.end_host(host.name, error)
+        return host.name
+
+    def run(self, writer=None):
+        """
+        Run all reports against all hosts
+
+        Up to config['host-parallelism'] hosts are audited at the same time
+
+        :param writer: labsdb.auditor.output.ReportWriter to stream reports to as they are generated
+        :return: If no writer is given, list of host reports in config order
+        """
+        collector = None
+        if writer is None:
+            writer = collector = ReportCollector()
+        run_host = functools.partial(self._run_host, writer=writer)
+
+        hosts = self.config['hosts']
+        writer.start([_host_config(self.config, entry)['host'] for entry in hosts])
+        # Fork the view definer parsing workers once, from this thread and before
+        # any host threads start, so that they do not inherit locks held by those
+        workers = self.config.get('view-parse-workers', 0)
+        self._parse_pool = multiprocessing.Pool(workers) if workers > 0 else None
+        parallelism = min(self.config.get('host-parallelism', 1), len(hosts))
+        try:
+            if parallelism <= 1:
+                names = [run_host(entry) for entry in hosts]
+            else:
+                pool = ThreadPool(parallelism)
+                try:
+                    names = pool.map(run_host, hosts)
+                finally:
+                    pool.close()
+                    pool.join()
+        finally:
+            if self._parse_pool is not None:
+                self._parse_pool.close()
+                self._parse_pool.join()
+                self._parse_pool = None
+
+        if collector is not None:
+            return [collector.hosts[name] for name in names]
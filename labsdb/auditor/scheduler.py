@@ -0,0 +1,185 @@
+# Copyright 2015 Yuvi Panda <yuvipanda@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Scheduling of queries against a host, adapted to how well the host is doing
+
+The hosts are production replicas that users query heavily, so with
+adaptive-scheduling on, the audit backs off when a host is struggling.
+Every health-check-interval seconds the replication lag and number of
+running threads of the host are checked, and:
+
+    - if both are under max-replication-lag and max-threads-running, the
+      delay between queries is halved (down to none), and once there is no
+      delay, the number of connections in use is increased by one (up to
+      db-parallelism)
+    - otherwise the number of connections in use is halved, and once it is
+      down to one, the delay between queries is doubled (up to max-query-delay)
+"""
+import logging
+import threading
+import time
+
+import MySQLdb
+
+from labsdb.auditor.metrics import REGISTRY
+
+# Initial delay between queries, when backing off with a single connection
+MIN_QUERY_DELAY = 0.1
+
+
+class Scheduler(object):
+    """
+    Limits how many connections to a host are in use at once, and paces queries on them
+    """
+    def __init__(self, host, config):
+        """
+        :param host: Host to schedule queries to, and to check the health of
+        :param config: Config of the host
+        """
+        self.host = host
+        self.max_concurrency = max(config.get('db-parallelism', 1), 1)
+        self.adaptive = config.get('adaptive-scheduling', False)
+        self.max_lag = config.get('max-replication-lag', 300)
+        self.max_threads_running = config.get('max-threads-running', 50)
+        self.interval = config.get('health-check-interval', 10)
+        self.max_delay = config.get('max-query-delay', 5.0)
+        # Start in the middle, and find the right concurrency from there
+        self.concurrency = max(self.max_concurrency // 2, 1) if self.adaptive else self.max_concurrency
+        self.delay = 0.0
+        self._cond = threading.Condition()
+        self._active = 0
+        self._checking = False
+        self._last_check = 0
+        self._conn = None
+
+    def acquire(self):
+        """
+        Wait until another connection may be used
+        """
+        self._maybe_check_health()
+        with self._cond:
+            while self._active >= self.concurrency:
+                self._cond.wait()
+            self._active += 1
+
+    def release(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    def pace(self):
+        """
+        Called before every query, waits for the current delay between queries
+        """
+        self._maybe_check_health()
+        delay = self.delay
+        if delay:
+            time.sleep(delay)
+
+    def _maybe_check_health(self):
+        if not self.adaptive:
+            return
+        with self._cond:
+            if self._checking or time.time() - self._last_check < self.interval:
+                return
+            self._checking = True
+        try:
+            self.adjust(*self.check_health())
+        finally:
+            with self._cond:
+                self._checking = False
+                self._last_check = time.time()
+
+    def _replication_lag(self, cur):
+        """
+        Get the replication lag in seconds of the host, the largest of all its replication connections
+
+        labsdb hosts are multi source MariaDB replicas, for which SHOW SLAVE STATUS
+        only shows the default connection (usually none), so all connections are
+        looked at with SHOW ALL SLAVES STATUS. Servers without it (MySQL) fall back
+        to SHOW SLAVE STATUS. None if the host is not replicating.
+        """
+        try:
+            cur.execute('SHOW ALL SLAVES STATUS')
+        except MySQLdb.ProgrammingError:
+            cur.execute('SHOW SLAVE STATUS')
+        column = [d[0] for d in cur.description].index('Seconds_Behind_Master') if cur.description else None
+        # Seconds_Behind_Master is NULL for a connection that is not running
+        lags = [row[column] for row in cur.fetchall() if row[column] is not None]
+        return max(lags) if lags else None
+
+    def check_health(self):
+        """
+        Get (replication lag in seconds, number of running threads) of the host
+
+        Either is None if it could not be found out, eg. when the host is not
+        replicating, or the health check connection lacks privileges.
+        """
+        lag = threads_running = None
+        try:
+            if self._conn is None:
+                self._conn = self.host.connect()
+            cur = self._conn.cursor()
+            try:
+                lag = self._replication_lag(cur)
+            except MySQLdb.OperationalError as e:
+                if e.args[0] not in (1227, ):  # Access denied, needs the REPLICATION CLIENT privilege
+                    raise
+            cur.execute("SHOW GLOBAL STATUS LIKE 'Threads_running'")
+            row = cur.fetchone()
+            if row is not None:
+                threads_running = int(row[1])
+            cur.close()
+        except MySQLdb.Error:
+            logging.warning('Checking health of %s failed', self.host.name, exc_info=True)
+            self.close()
+        return lag, threads_running
+
+    def adjust(self, lag, threads_running):
+        """
+        Adjust concurrency and delay between queries to the health of the host
+        """
+        healthy = ((lag is None or lag <= self.max_lag) and
+                   (threads_running is None or threads_running <= self.max_threads_running))
+        with self._cond:
+            if healthy:
+                if self.delay:
+                    self.delay = self.delay / 2 if self.delay / 2 >= MIN_QUERY_DELAY else 0.0
+                else:
+                    self.concurrency = min(self.concurrency + 1, self.max_concurrency)
+            else:
+                if self.concurrency > 1:
+                    self.concurrency = max(self.concurrency // 2, 1)
+                else:
+                    self.delay = min(max(self.delay * 2, MIN_QUERY_DELAY), self.max_delay)
+            self._cond.notify_all()
+        logging.info('Scheduling for %s: concurrency %s, query delay %s (replication lag %s, threads running %s)',
+                     self.host.name, self.concurrency, self.delay, lag, threads_running)
+        REGISTRY.set('labsdb_auditor_concurrency', self.concurrency, host=self.host.name)
+        REGISTRY.set('labsdb_auditor_query_delay_seconds', self.delay, host=self.host.name)
+        if lag is not None:
+            REGISTRY.set('labsdb_auditor_replication_lag_seconds', lag, host=self.host.name)
+        if threads_running is not None:
+            REGISTRY.set('labsdb_auditor_threads_running', threads_running, host=self.host.name)
+
+    def close(self):
+        """
+        Close the health check connection
+        """
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            try:
+                conn.close()
+            except MySQLdb.Error:
+                pass
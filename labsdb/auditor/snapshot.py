@@ -0,0 +1,67 @@
+# Copyright 2015 Yuvi Panda <yuvipanda@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+State persisted between audit runs, for incremental audits
+"""
+import json
+import logging
+import os
+
+from labsdb.auditor.utils import json_loads
+
+
+class Snapshot(object):
+    """
+    What each host looked like on the last run, stored as JSON in a local state file
+
+    Each host has a dict, with keys:
+
+        - databases -> list of databases on the host
+        - tables -> dict of db -> list of tables in it
+        - views -> dict of db -> dict of view name -> dict with
+                   'definer' (MD5 of the view definition, computed by the server),
+                   'model' (digest of the model table it was diffed against) and
+                   'diff' (result of the diff, None if there were no differences)
+
+    Reports update these as they go, and only redo work for what changed.
+    """
+    def __init__(self, path, hosts=None):
+        self.path = path
+        self.hosts = hosts if hosts is not None else {}
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load snapshot from path, or start an empty one if it does not exist
+        """
+        if not os.path.exists(path):
+            logging.info('No snapshot found at %s, doing a full run', path)
+            return cls(path)
+        with open(path) as f:
+            return cls(path, json_loads(f.read())['hosts'])
+
+    def host(self, name):
+        """
+        Get (creating if needed) the snapshot dict for given host
+        """
+        return self.hosts.setdefault(name, {})
+
+    def save(self):
+        """
+        Atomically write the snapshot back to its state file
+        """
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'hosts': self.hosts}, f)
+        os.rename(tmp_path, self.path)
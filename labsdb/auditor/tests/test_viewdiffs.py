@@ -0,0 +1,93 @@
+# Copyright 2015 Yuvi Panda <yuvipanda@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Tests for cleaning up, parsing and diffing view definers
+
+Definers are rendered from the tableschema files the way MySQL shows them,
+so these cover every table the auditor actually checks.
+"""
+import os
+
+import pytest
+
+from labsdb.auditor.fakedb import FakeCluster
+from labsdb.auditor.host import Host
+from labsdb.auditor.modelcache import load_tables
+from labsdb.auditor.models import Model
+from labsdb.auditor.reports import viewdiffs
+from labsdb.auditor.viewsql import parse_view_sql, parse_view_sql_pyparsing, render_view_definition, render_view_sql
+
+ROOT = os.path.join(os.path.dirname(__file__), '..', '..', '..')
+TABLES = load_tables([os.path.join(ROOT, 'whitelisted.yaml'), os.path.join(ROOT, 'greylisted.yaml')])
+DBS = ['enwiki', 'officewiki', 'zh_min_nanwiki', 'archive']
+
+
+def _show_create_view(name, definition):
+    return ('CREATE ALGORITHM=UNDEFINED DEFINER=`viewmaster`@`%%` SQL SECURITY DEFINER VIEW `%s` AS %s'
+            % (name, definition))
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    viewdiffs.clear_caches()
+    yield
+    viewdiffs.clear_caches()
+
+
+@pytest.mark.parametrize('name', sorted(TABLES))
+def test_cleaned_definers_parse_into_model(name):
+    table = TABLES[name]
+    for db in DBS:
+        full_sql = _show_create_view(name, render_view_definition(table, db))
+        sql = viewdiffs._cleanup_viewdefiner(full_sql, db + '_p', table.table_name)
+        # The same for every wiki, so that the parse cache is shared between them
+        assert sql == render_view_sql(table)
+        assert parse_view_sql(sql, name).freeze() == table
+        assert parse_view_sql_pyparsing(sql, name).freeze() == table
+        assert viewdiffs._diff_view(table, name, sql, parse_view_sql) is None
+
+
+def test_foreign_db_is_reported():
+    table = TABLES['archive']
+    definition = render_view_definition(table, 'enwiki').replace('`enwiki`.', '`officewiki`.')
+    sql = viewdiffs._cleanup_viewdefiner(_show_create_view('archive', definition), 'enwiki_p', table.table_name)
+    assert viewdiffs._diff_view(table, 'archive', sql, parse_view_sql) == {
+        'qualifiers': {'expected': [], 'found': ['officewiki']}
+    }
+    # Not mistaken for the clean definer of the view once that is known
+    clean_sql = viewdiffs._cleanup_view_definition(render_view_definition(table, 'enwiki'), 'enwiki_p',
+                                                   table.table_name)
+    assert viewdiffs._diff_view(table, 'archive', clean_sql, parse_view_sql) is None
+    assert viewdiffs._diff_view(table, 'archive', sql, parse_view_sql) is not None
+
+
+@pytest.fixture
+def cluster():
+    dbs = ['wiki%d' % i for i in range(3)]
+    model = Model(dbs, [db + '_p' for db in dbs], TABLES)
+    return model, FakeCluster(model, tables_per_wiki=5)
+
+
+@pytest.mark.parametrize('config', [{}, {'bulk-view-fetch': False}, {'dedup-view-diffs': True}])
+def test_base_table_with_view_name_is_reported(cluster, config):
+    model, fake = cluster
+    name = sorted(fake.views['wiki1_p'])[0]
+    del fake.views['wiki1_p'][name]
+    host = Host(dict(config, host='fake'), fake.connect)
+    try:
+        host.load_catalog()
+        report = viewdiffs.views_schema_diff_report(host.config, model, host)
+    finally:
+        host.close()
+    assert report == {'wiki1_p': {name: {'not_a_view': True}}}
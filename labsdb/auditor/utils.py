@@ -14,6 +14,29 @@
 """
 Collection of utilities
 """
+import hashlib
+import json
+from collections import OrderedDict
+
+import yaml
+
+# Use the libyaml based C emitter / parser when available, they are much faster
+Dumper = getattr(yaml, 'CDumper', yaml.Dumper)
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+class OrderedSafeLoader(SafeLoader):
+    """
+    SafeLoader that loads mappings into OrderedDicts, keeping the order they are written in
+    """
+
+
+def _construct_ordered_mapping(loader, node):
+    loader.flatten_mapping(node)
+    return OrderedDict(loader.construct_pairs(node))
+
+
+OrderedSafeLoader.add_constructor(yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG, _construct_ordered_mapping)
 
 
 def get_databases(conn):
@@ -56,3 +79,37 @@ def common_iters(iter1, iter2):
     :return: Items in iter1 *and* iter2
     """
     return set(iter1).intersection(iter2)
+
+
+def _str_strings(obj):
+    if isinstance(obj, dict):
+        return dict((_str_strings(k), _str_strings(v)) for k, v in obj.items())
+    if isinstance(obj, list):
+        return [_str_strings(v) for v in obj]
+    if not isinstance(obj, str) and isinstance(obj, type(u'')):
+        return obj.encode('utf-8')
+    return obj
+
+
+def json_loads(data):
+    """
+    Load a JSON document, with plain str instead of unicode strings
+
+    json gives unicode strings on python 2, and yaml.dump would tag those
+    with !!python/unicode in reports. A no-op on python 3.
+    """
+    obj = json.loads(data)
+    return _str_strings(obj) if str is bytes else obj
+
+
+def db_shard(db, shard_count):
+    """
+    Get the shard (1 to shard_count) that db belongs to
+
+    Depends only on the name of the db, so it is stable across runs, machines
+    and changes to the dblists. A public db is in the same shard as its
+    private db.
+    """
+    if db.endswith('_p'):
+        db = db[:-2]
+    return int(hashlib.md5(db.encode('utf-8')).hexdigest(), 16) % shard_count + 1
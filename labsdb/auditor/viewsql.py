@@ -0,0 +1,184 @@
+# Copyright 2015 Yuvi Panda <yuvipanda@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Parsing and rendering of the SQL that defines the public views
+
+We have to parse a specific subset of SQL, that is used to define views
+The Grammar is:
+
+sql = "SELECT" { column-defintions } "FROM" wikiname.tablename [ "WHERE" cond ]
+column-definition = column-name "AS" column-name
+                    | "NULL" "AS" column-name
+                    | "IF(" cond ", NULL, " column-name ")" "AS" column-name
+
+Where cond is a valid SQL relational expression, column-name, wikiname, tablename are strings
+
+All functions here work on definer SQL that has been cleaned up by
+reports.viewdiffs._cleanup_viewdefiner, so the wikiname and tablename qualifiers of
+the view's own table are already stripped.
+"""
+import re
+
+from labsdb.auditor.models import Column, Table
+
+
+_SELECT_RE = re.compile(r'\s*select')
+# Mirrors column_definition in the pyparsing grammar below, including its
+# treatment of whitespace. null_if is everything up to the first comma.
+_COLUMN_RE = re.compile(r'\s*(?:if\(\s*([^,]*),\s*\w+\s*,\s*\w+\s*\)|(\w+))\s*AS\s*(\w+)(?:\s*,)?')
+_FROM_RE = re.compile(r'\s*from\s*(\w+)(?:\s*where\s*(.*))?\s*\Z', re.DOTALL)
+
+
+def parse_view_sql(sql, viewname):
+    """
+    Build a Table object given a cleaned up SQL statement that defines the view
+
+    Single pass, regex based parser for the grammar above. Produces the
+    same Table as parse_view_sql_pyparsing, which is kept as the reference
+    implementation.
+
+    :raises ValueError: if sql does not match the grammar
+    """
+    match = _SELECT_RE.match(sql)
+    if not match:
+        raise ValueError('Expected select at the start of view definition: %s' % sql)
+    columns = []
+    pos = match.end()
+    match = _COLUMN_RE.match(sql, pos)
+    while match:
+        columns.append(match.groups())
+        pos = match.end()
+        match = _COLUMN_RE.match(sql, pos)
+    match = _FROM_RE.match(sql, pos)
+    if not columns or not match:
+        raise ValueError('Could not parse view definition at char %s: %s' % (pos, sql))
+
+    table = Table(viewname, {}, match.group(2) or None, match.group(1))
+    for null_if, expression, name in columns:
+        table.add_column(Column(name,
+                                whitelisted=not null_if and expression != 'NULL',
+                                null_if=null_if or None))
+    return table
+
+
+_grammar = None
+
+
+def _pyparsing_grammar():
+    """
+    Build (once) the pyparsing grammar for view definitions
+
+    Built lazily so that pyparsing is only imported when it is used.
+
+    :return: (sql_definition, column_definition) pyparsing elements
+    """
+    global _grammar
+    if _grammar is None:
+        from pyparsing import OneOrMore, Optional, Word, SkipTo, StringEnd, alphanums
+        identifier = alphanums + "_"
+        if_definition = "if(" + SkipTo(",")("null_if") + "," + Word(identifier) + "," + Word(identifier) + ")"
+        column_definition = (if_definition ^ Word(identifier)('expression')) + "AS" + Word(identifier)("name") + \
+            Optional(",")
+        sql_definition = "select" + OneOrMore(column_definition)("columns") + \
+                         "from" + Word(identifier)("tablename") + \
+                         Optional("where" + SkipTo(StringEnd())("include_row_if")) + StringEnd()
+        _grammar = sql_definition, column_definition
+    return _grammar
+
+
+def parse_view_sql_pyparsing(sql, viewname):
+    """
+    Build a Table object given a cleaned up SQL statement that defines the view
+
+    Reference implementation using pyparsing, much slower than parse_view_sql
+    since every column gets parsed twice by a combinator engine.
+
+    :raises pyparsing.ParseException: if sql does not match the grammar
+    """
+    sql_definition, column_definition = _pyparsing_grammar()
+    res = sql_definition.parseString(sql)
+    table = Table(viewname, {}, res.include_row_if if res.include_row_if else None, res.tablename)
+    for tokens, start, end in column_definition.scanString(sql):
+        table.add_column(Column(tokens.name,
+                                whitelisted=tokens.null_if == '' and tokens.expression != 'NULL',
+                                null_if=tokens.null_if if tokens.null_if else None))
+    return table
+
+
+PARSERS = {
+    'fast': parse_view_sql,
+    'pyparsing': parse_view_sql_pyparsing,
+}
+
+
+def render_view_sql(table):
+    """
+    Render the cleaned up SQL statement that a view matching table would be defined by
+
+    Columns are rendered in the order of table.columns, which is the order the
+    tableschema lists them in for tables from labsdb.auditor.modelcache.load_tables.
+    """
+    columns = []
+    for name in table.columns:
+        column = table.columns[name]
+        if column.whitelisted:
+            columns.append('%s AS %s' % (name, name))
+        elif column.null_if:
+            columns.append('if(%s,NULL,%s) AS %s' % (column.null_if, name, name))
+        else:
+            columns.append('NULL AS %s' % (name, ))
+    sql = 'select %s from %s' % (','.join(columns), table.table_name)
+    if table.include_row_if:
+        sql += ' where ' + table.include_row_if
+    return sql
+
+
+# Identifiers in an SQL expression, skipping string literals, keywords and function names
+_EXPRESSION_IDENTIFIER_RE = re.compile(r"('(?:[^'\\]|\\.)*')|\b([A-Za-z_]\w*)\b(?!\s*\()")
+_SQL_KEYWORDS = frozenset(['and', 'or', 'not', 'is', 'in', 'like', 'between', 'null', 'true', 'false'])
+
+
+def _qualify_expression(expression, prefix):
+    def qualify(match):
+        if match.group(1) or match.group(2).lower() in _SQL_KEYWORDS:
+            return match.group(0)
+        return '%s`%s`' % (prefix, match.group(2))
+    return _EXPRESSION_IDENTIFIER_RE.sub(qualify, expression)
+
+
+def render_view_definition(table, db):
+    """
+    Render the definer SQL that MySQL would show for a view matching table in db
+
+    This is what information_schema.VIEWS.VIEW_DEFINITION would contain, with
+    every identifier quoted and fully qualified with db and table names.
+    Cleaning it up gives render_view_sql(table).
+
+    :param db: Name of the private db the view selects from
+    """
+    prefix = '`%s`.`%s`.' % (db, table.table_name)
+    columns = []
+    for name in table.columns:
+        column = table.columns[name]
+        if column.whitelisted:
+            columns.append('%s`%s` AS `%s`' % (prefix, name, name))
+        elif column.null_if:
+            columns.append('if(%s,NULL,%s`%s`) AS `%s`' % (
+                _qualify_expression(column.null_if, prefix), prefix, name, name))
+        else:
+            columns.append('NULL AS `%s`' % (name, ))
+    sql = 'select %s from `%s`.`%s`' % (','.join(columns), db, table.table_name)
+    if table.include_row_if:
+        sql += ' where ' + _qualify_expression(table.include_row_if, prefix)
+    return sql